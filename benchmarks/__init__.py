@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the ETL, the pySQL_library queries and the page callbacks.
+
+    python -m benchmarks.generate 1m data/bench       # write a synthetic dataset
+    python -m benchmarks.run --sizes 10k 1m           # time everything, write JSON
+    python -m benchmarks.run --compare old.json new.json
+    python -m benchmarks.loadtest --users 8 --duration 30  # concurrent callback load
+
+"""
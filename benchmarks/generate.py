@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Deterministic synthetic versions of customer_details.csv and
+sales_transactions.csv, in the same columns and d/mm/yyyy date format as the
+exports the ETL downloads. The same size and seed always give the same files.
+
+Customers and products follow a Zipf-like popularity curve, customer states
+follow the population split and regions are uneven, so the aggregations see
+realistic skew rather than uniform noise.
+
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+
+SALES_COLUMNS = ['TransactionID', 'Date', 'CustomerID', 'ProductID', 'Quantity', 'Price', 'Discount',
+                 'TotalAmount', 'StoreID', 'Region', 'SalespersonID']
+
+# State population shares and their capitals
+STATES = {
+    'NSW': (0.31, 'Sydney', '2000'), 'VIC': (0.26, 'Melbourne', '3000'), 'QLD': (0.20, 'Brisbane', '4000'),
+    'WA': (0.11, 'Perth', '6000'), 'SA': (0.07, 'Adelaide', '5000'), 'TAS': (0.02, 'Hobart', '7000'),
+    'ACT': (0.02, 'Canberra', '2600'), 'NT': (0.01, 'Darwin', '800'),
+}
+REGIONS = {'East': 0.38, 'South': 0.27, 'North': 0.2, 'West': 0.15}
+
+START_DATE = '2022-01-01'
+DAYS = 730
+
+# Rows generated and written at a time, so 10m rows never sit in memory at once
+CHUNK_ROWS = 1_000_000
+
+
+def parse_size(size):
+    """'1m' -> 1000000, plain integers are accepted too."""
+    return SIZES[size] if size in SIZES else int(size)
+
+
+def dataset_shape(rows):
+    """Customer and product counts that grow with the number of sales rows."""
+    return {'customers': max(50, rows // 50), 'products': max(50, min(2000, rows // 2000))}
+
+
+def _zipf_weights(n, rng, exponent=1.1):
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    rng.shuffle(weights)  # the most popular ids are spread over the range
+    return weights / weights.sum()
+
+
+def _choice_weights(mapping):
+    weights = np.array([value[0] if isinstance(value, tuple) else value for value in mapping.values()])
+    return list(mapping), weights / weights.sum()
+
+
+def _format_dates(dates):
+    # d/mm/yyyy, as in the CSV exports (SQL_ISO_DATE / to_iso_date convert it on ingest)
+    return dates.day.astype(str) + '/' + dates.strftime('%m/%Y')
+
+
+def generate_customers(count, seed=0):
+    """customer_details rows for CustomerIDs 1000 .. 1000 + count - 1."""
+    rng = np.random.default_rng(seed)
+    states, weights = _choice_weights(STATES)
+    state = rng.choice(states, size=count, p=weights)
+    return pd.DataFrame({
+        'CustomerID': np.arange(1000, 1000 + count),
+        'CustomerName': [f'Customer_{i}' for i in range(count)],
+        'City': [STATES[s][1] for s in state],
+        'State': state,
+        'Postcode': [STATES[s][2] for s in state],
+    })
+
+
+def generate_sales(rows, shape, seed=0, first_transaction=1):
+    """Yield sales_transactions frames of up to CHUNK_ROWS rows, rows in total."""
+    rng = np.random.default_rng(seed + 1)
+    # A few heavy customers and best sellers, with a long tail behind them
+    customer_weights = _zipf_weights(shape['customers'], rng, exponent=0.8)
+    product_weights = _zipf_weights(shape['products'], rng, exponent=1.0)
+    product_prices = np.round(rng.lognormal(mean=3.3, sigma=0.6, size=shape['products']), 2)
+    regions, region_weights = _choice_weights(REGIONS)
+    start = pd.Timestamp(START_DATE)
+
+    done = 0
+    while done < rows:
+        n = min(CHUNK_ROWS, rows - done)
+        product = rng.choice(shape['products'], size=n, p=product_weights)
+        quantity = rng.integers(1, 20, size=n)
+        price = product_prices[product]
+        discount = np.round(rng.uniform(0, 20, size=n), 2)
+        dates = start + pd.to_timedelta(np.sort(rng.integers(0, DAYS, size=n)), unit='D')
+        yield pd.DataFrame({
+            'TransactionID': np.arange(first_transaction + done, first_transaction + done + n),
+            'Date': _format_dates(pd.DatetimeIndex(dates)),
+            'CustomerID': 1000 + rng.choice(shape['customers'], size=n, p=customer_weights),
+            'ProductID': 200 + product,
+            'Quantity': quantity,
+            'Price': price,
+            'Discount': discount,
+            'TotalAmount': np.round(quantity * price - discount, 2),
+            'StoreID': rng.integers(1, 11, size=n),
+            'Region': rng.choice(regions, size=n, p=region_weights),
+            'SalespersonID': rng.integers(500, 550, size=n),
+        }, columns=SALES_COLUMNS)
+        done += n
+
+
+def write_dataset(directory, rows, seed=0):
+    """
+    Write customer_details.csv and sales_transactions.csv for a dataset of the
+    given size into directory, reusing them if they already exist.
+    Returns (customer_csv, sales_csv).
+    """
+    os.makedirs(directory, exist_ok=True)
+    customer_csv = os.path.join(directory, 'customer_details.csv')
+    sales_csv = os.path.join(directory, 'sales_transactions.csv')
+    marker = os.path.join(directory, f'.complete-{rows}-{seed}')
+    if os.path.exists(marker):
+        return customer_csv, sales_csv
+
+    shape = dataset_shape(rows)
+    generate_customers(shape['customers'], seed).to_csv(customer_csv, index=False)
+    with open(sales_csv, 'w', newline='') as f:
+        for i, chunk in enumerate(generate_sales(rows, shape, seed)):
+            chunk.to_csv(f, index=False, header=(i == 0))
+    open(marker, 'w').close()
+    return customer_csv, sales_csv
+
+
+def append_sales(sales_csv, rows, total_rows, seed=0):
+    """Append rows new transactions after total_rows existing ones, as an incremental export would."""
+    shape = dataset_shape(total_rows)
+    with open(sales_csv, 'a', newline='') as f:
+        for chunk in generate_sales(rows, shape, seed + 100, first_transaction=total_rows + 1):
+            chunk.to_csv(f, index=False, header=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic sales dataset.')
+    parser.add_argument('size', help=f"number of sales rows or one of {', '.join(SIZES)}")
+    parser.add_argument('directory')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(write_dataset(args.directory, parse_size(args.size), args.seed))
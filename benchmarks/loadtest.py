@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+Headless load test for the Dash app. Starts the app on localhost (gunicorn when
+it is installed, otherwise a threaded werkzeug server), then has a number of
+simulated users replay interaction scenarios against the real
+/_dash-update-component endpoint, the same requests a browser sends:
+
+    navigation      display_page over every route
+    overview        date range and region changes on the overview page
+    region          date range changes on the sales by region page
+    sliders         slider sweeps on top customers and best selling products
+    session         a user visiting every page in turn (the default)
+
+Payloads are built from the server's own /_dash-dependencies, and the date
+ranges and regions from the layouts it returns. Requests copied from the
+browser's developer tools can be replayed with --replay (a JSON list of
+{"label": ..., "payload": ...}).
+
+Throughput, p50/p95/p99 latency and response size are reported per callback
+and written to JSON. --max-p95-ms and --max-error-rate make the exit status
+fail, so releases can be gated on the result. Only localhost is ever targeted.
+
+    python -m benchmarks.loadtest --users 8 --duration 30 --workers 2
+
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import numpy as np
+import requests
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+ROUTES = ['/overview', '/sales-by-region', '/top-customers', '/best-selling-products']
+
+# Callbacks are found in /_dash-dependencies by one of their outputs
+CALLBACK_OUTPUTS = {
+    'display_page': 'page-content.children',
+    'overview': 'customer-histogram.figure',
+    'sales_by_region': 'diamond-graph.figure',
+    'top_customers': 'top-customers-graph.figure',
+    'best_selling_products': 'top-products-graph.figure',
+}
+
+
+###############################################################################
+
+#################### Server ####################
+
+###############################################################################
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _has_gunicorn():
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def start_server(port, workers=1, threads=4, kind='auto', env=None):
+    """Start app.py's server on 127.0.0.1:port in a subprocess and wait for it to answer."""
+    if kind == 'auto':
+        kind = 'gunicorn' if _has_gunicorn() else 'werkzeug'
+    if kind == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+                   '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:server']
+    else:
+        command = [sys.executable, '-c',
+                   'from werkzeug.serving import run_simple; from app import server; '
+                   f'run_simple("127.0.0.1", {port}, server, threaded=True)']
+
+    # A file, not a pipe: an unread pipe fills with access log lines and blocks the server
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=dict(os.environ, **(env or {})),
+                               stdout=subprocess.DEVNULL, stderr=log)
+    base = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise RuntimeError(f'Server exited: {log.read().decode(errors="replace")[-2000:]}')
+        try:
+            if requests.get(f'{base}/_dash-dependencies', timeout=2).ok:
+                return process, base, kind
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError('Server did not start within 60 seconds')
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+###############################################################################
+
+#################### Requests and scenarios ####################
+
+###############################################################################
+
+def _split_output(output):
+    def prop(spec):
+        component, name = spec.rsplit('.', 1)
+        return {'id': component, 'property': name}
+    if output.startswith('..'):
+        return [prop(spec) for spec in output.strip('.').split('...')]
+    return prop(output)
+
+
+def load_callbacks(session, base):
+    """{callback name: dependency} for CALLBACK_OUTPUTS, from the server's callback graph."""
+    dependencies = session.get(f'{base}/_dash-dependencies', timeout=30).json()
+    callbacks = {}
+    for name, output in CALLBACK_OUTPUTS.items():
+        for dependency in dependencies:
+            if output in dependency['output'].strip('.').split('...'):
+                callbacks[name] = dependency
+                break
+        else:
+            raise KeyError(f'No callback with output {output} on the server')
+    return callbacks
+
+
+def callback_payload(dependency, values):
+    """The JSON body a browser posts to /_dash-update-component for these input values."""
+    inputs = [dict(spec, value=value) for spec, value in zip(dependency['inputs'], values)]
+    return {
+        'output': dependency['output'],
+        'outputs': _split_output(dependency['output']),
+        'inputs': inputs,
+        'changedPropIds': [f"{inputs[0]['id']}.{inputs[0]['property']}"] if inputs else [],
+        'state': [dict(spec, value=None) for spec in dependency.get('state', [])],
+    }
+
+
+def _find_props(component, component_id):
+    if isinstance(component, dict):
+        props = component.get('props')
+        if isinstance(props, dict) and props.get('id') == component_id:
+            return props
+        for value in (props or component).values():
+            found = _find_props(value, component_id)
+            if found is not None:
+                return found
+    elif isinstance(component, list):
+        for item in component:
+            found = _find_props(item, component_id)
+            if found is not None:
+                return found
+    return None
+
+
+def discover_filters(session, base, callbacks):
+    """Date bounds and regions, read from the overview layout the server returns."""
+    payload = callback_payload(callbacks['display_page'], ['/overview'])
+    layout = session.post(f'{base}/_dash-update-component', json=payload, timeout=60).json()
+    dates = _find_props(layout, 'date-picker-range') or {}
+    regions = _find_props(layout, 'region-filter') or {}
+    return {
+        'min_date': str(dates.get('min_date_allowed') or dates.get('start_date'))[:10],
+        'max_date': str(dates.get('max_date_allowed') or dates.get('end_date'))[:10],
+        'regions': [option['value'] if isinstance(option, dict) else option for option in regions.get('options', [])],
+    }
+
+
+def date_windows(filters):
+    """The handful of ranges users flip between: last month, quarter and year, and everything."""
+    end = np.datetime64(filters['max_date'])
+    start = np.datetime64(filters['min_date'])
+    windows = [(str(max(start, end - np.timedelta64(days, 'D'))), str(end)) for days in (30, 91, 365)]
+    windows.append((str(start), str(end)))
+    return windows
+
+
+def region_sets(filters):
+    regions = filters['regions']
+    return [regions] + [[region] for region in regions]
+
+
+def scenario_navigation(filters, rng):
+    for route in ROUTES:
+        yield 'display_page', [route]
+
+
+def scenario_overview(filters, rng):
+    windows, regions = date_windows(filters), region_sets(filters)
+    for _ in range(5):
+        start, end = rng.choice(windows)
+        yield 'overview', [start, end, rng.choice(regions)]
+
+
+def scenario_region(filters, rng):
+    windows = date_windows(filters)
+    for _ in range(5):
+        yield 'sales_by_region', list(rng.choice(windows))
+
+
+def scenario_sliders(filters, rng):
+    for value in range(1, 21):
+        yield 'top_customers', [value]
+    for value in range(1, 21):
+        yield 'best_selling_products', [value]
+
+
+def scenario_session(filters, rng):
+    windows, regions = date_windows(filters), region_sets(filters)
+    yield 'display_page', ['/overview']
+    for _ in range(3):
+        start, end = rng.choice(windows)
+        yield 'overview', [start, end, rng.choice(regions)]
+    yield 'display_page', ['/sales-by-region']
+    for _ in range(2):
+        yield 'sales_by_region', list(rng.choice(windows))
+    yield 'display_page', ['/top-customers']
+    for value in sorted(rng.sample(range(1, 21), 5)):
+        yield 'top_customers', [value]
+    yield 'display_page', ['/best-selling-products']
+    for value in sorted(rng.sample(range(1, 21), 5)):
+        yield 'best_selling_products', [value]
+
+
+SCENARIOS = {
+    'navigation': scenario_navigation,
+    'overview': scenario_overview,
+    'region': scenario_region,
+    'sliders': scenario_sliders,
+    'session': scenario_session,
+}
+
+
+###############################################################################
+
+#################### Load generation ####################
+
+###############################################################################
+
+class Recorder:
+    """Thread-safe collection of (latency, bytes, ok) per callback label."""
+
+    def __init__(self):
+        self._samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def add(self, label, seconds, size, ok):
+        with self._lock:
+            self._samples[label].append((seconds, size, ok))
+
+    def summary(self, elapsed):
+        with self._lock:
+            samples = {label: list(values) for label, values in self._samples.items()}
+        everything = [sample for values in samples.values() for sample in values]
+        report = {}
+        for label, values in sorted(samples.items()) + [('ALL', everything)]:
+            if not values:
+                continue
+            latencies = np.array([seconds for seconds, _, _ in values]) * 1000
+            sizes = np.array([size for _, size, _ in values])
+            errors = sum(1 for _, _, ok in values if not ok)
+            report[label] = {
+                'requests': len(values),
+                'errors': errors,
+                'error_rate': errors / len(values),
+                'throughput_rps': len(values) / elapsed if elapsed else 0.0,
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p95_ms': float(np.percentile(latencies, 95)),
+                'p99_ms': float(np.percentile(latencies, 99)),
+                'mean_bytes': float(sizes.mean()),
+                'max_bytes': int(sizes.max()),
+            }
+        return report
+
+
+def _user(base, steps_for, recorder, start_measuring, stop_at, think_seconds, seed):
+    rng = random.Random(seed)
+    session = requests.Session()
+    while time.time() < stop_at:
+        for label, payload in steps_for(rng):
+            if time.time() >= stop_at:
+                break
+            begin = time.perf_counter()
+            try:
+                response = session.post(f'{base}/_dash-update-component', json=payload, timeout=120)
+                ok, size = response.status_code in (200, 204), len(response.content)
+            except requests.RequestException:
+                ok, size = False, 0
+            if time.time() >= start_measuring:
+                recorder.add(label, time.perf_counter() - begin, size, ok)
+            if think_seconds:
+                time.sleep(think_seconds)
+
+
+def run_load(base, scenario='session', users=4, duration=30.0, warmup=5.0, think_ms=0, replay=None, seed=0):
+    """Drive the server at base with users concurrent users and return the per-callback report."""
+    if urlparse(base).hostname not in LOCAL_HOSTS:
+        raise ValueError(f'Refusing to load test {base}, only localhost is allowed')
+
+    session = requests.Session()
+    if replay is not None:
+        recorded = [(step.get('label', step['payload']['output']), step['payload']) for step in replay]
+        def steps_for(rng):
+            return iter(recorded)
+    else:
+        callbacks = load_callbacks(session, base)
+        filters = discover_filters(session, base, callbacks)
+        def steps_for(rng):
+            for label, values in SCENARIOS[scenario](filters, rng):
+                yield label, callback_payload(callbacks[label], values)
+
+    recorder = Recorder()
+    start_measuring = time.time() + warmup
+    stop_at = start_measuring + duration
+    threads = [
+        threading.Thread(target=_user, args=(base, steps_for, recorder, start_measuring, stop_at, think_ms / 1000, seed + i),
+                         daemon=True)
+        for i in range(users)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.summary(duration)
+
+
+def print_report(report):
+    print(f"{'callback':<24}{'requests':>9}{'errors':>7}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'mean KB':>9}")
+    for label, row in report.items():
+        print(f"{label:<24}{row['requests']:>9}{row['errors']:>7}{row['throughput_rps']:>8.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['mean_bytes'] / 1024:>9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the Dash callbacks on localhost.')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='session')
+    parser.add_argument('--replay', help='JSON list of recorded {"label", "payload"} requests to replay instead')
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds of load before measuring')
+    parser.add_argument('--think-ms', type=float, default=0, help='pause between a user\'s requests')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help='use a server already running on localhost instead of starting one')
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'werkzeug'], default='auto')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='environment for the started server, e.g. FIGURE_CACHE_BYTES=0')
+    parser.add_argument('--output', help='write the report and settings to this JSON file')
+    parser.add_argument('--max-p95-ms', type=float, help='fail if any callback p95 is above this')
+    parser.add_argument('--max-error-rate', type=float, default=0.0, help='fail if any callback errors more often')
+    args = parser.parse_args(argv)
+
+    replay = None
+    if args.replay:
+        with open(args.replay) as f:
+            replay = json.load(f)
+
+    process = None
+    base = args.url
+    server_kind = 'external'
+    if base is None:
+        env = dict(item.split('=', 1) for item in args.env)
+        process, base, server_kind = start_server(_free_port(), args.workers, args.threads, args.server, env)
+    try:
+        report = run_load(base, args.scenario, args.users, args.duration, args.warmup, args.think_ms, replay, args.seed)
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    print_report(report)
+    if args.output:
+        settings = {key: value for key, value in vars(args).items() if key not in ('output', 'replay')}
+        with open(args.output, 'w') as f:
+            json.dump({'settings': dict(settings, server=server_kind), 'report': report}, f, indent=2)
+
+    failed = [label for label, row in report.items()
+              if row['error_rate'] > args.max_error_rate
+              or (args.max_p95_ms is not None and row['p95_ms'] > args.max_p95_ms)]
+    if failed:
+        print(f"Failed thresholds: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Times the ETL, get_data(), the pySQL_library queries and every page callback
+against synthetic datasets (benchmarks.generate), and writes the results to
+JSON so runs on different commits can be compared:
+
+    python -m benchmarks.run --sizes 10k 1m --output before.json
+    python -m benchmarks.run --sizes 10k 1m --output after.json
+    python -m benchmarks.run --compare before.json after.json
+
+Run it from the repository root (the pages read data/australia.geojson).
+Each size gets its own database in the work directory; the generated CSVs are
+kept there and reused by later runs.
+
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import db_pool
+import pySQL_library as hrdb
+
+from benchmarks.generate import SIZES, append_sales, parse_size, write_dataset
+
+
+# New rows appended for the incremental update, as a share of the dataset
+INCREMENT_SHARE = 0.01
+
+# A timing this much slower than the baseline is reported as a regression
+REGRESSION_RATIO = 1.2
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _timed_once(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def _timed(func, *args, repeat=3, setup=None):
+    """Best and median wall time of repeat calls, running setup before each."""
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        runs.append(_timed_once(func, *args))
+    return {'min': min(runs), 'median': statistics.median(runs), 'runs': repeat}
+
+
+def _single(seconds):
+    return {'min': seconds, 'median': seconds, 'runs': 1}
+
+
+def benchmark_ingest(customer_csv, sales_csv, rows, seed):
+    """Full load, rollups and a 1% incremental update, through the existing ETL (its output is silenced)."""
+    timings = {}
+    with contextlib.redirect_stdout(io.StringIO()), db_pool.get_pool().writer() as conn:
+        timings['ingest.create_customerdetails_table'] = _single(_timed_once(hrdb.create_customerdetails_table, customer_csv, conn))
+        timings['ingest.create_salesdetails_table'] = _single(_timed_once(hrdb.create_salesdetails_table, sales_csv, conn))
+        timings['ingest.transform_data'] = _single(_timed_once(hrdb.transform_data, conn))
+        timings['ingest.rebuild_rollups'] = _single(_timed_once(hrdb.rebuild_rollups, conn))
+
+    increment = max(1, int(rows * INCREMENT_SHARE))
+    append_sales(sales_csv, increment, rows, seed)
+    with contextlib.redirect_stdout(io.StringIO()), db_pool.get_pool().writer() as conn:
+        start = time.perf_counter()
+        hrdb.update_database_from_csv(conn, customer_csv, sales_csv)
+        hrdb.transform_data(conn)
+        hrdb.update_rollups(conn)
+        timings['ingest.incremental_update'] = _single(time.perf_counter() - start)
+    return timings
+
+
+def benchmark_get_data(db):
+    """Cold get_data() through SQL, then from the Arrow snapshot once it is written."""
+    timings = {'get_data.sql': _timed(hrdb.get_data, repeat=1, setup=hrdb.invalidate_data_cache)}
+    with db_pool.get_pool().writer() as conn:
+        start = time.perf_counter()
+        written = hrdb.write_snapshot(conn, db)
+        if written:
+            timings['ingest.write_snapshot'] = _single(time.perf_counter() - start)
+    if written:
+        timings['get_data.snapshot'] = _timed(hrdb.get_data, setup=hrdb.invalidate_data_cache)
+    timings['get_data.cached'] = _timed(hrdb.get_data, repeat=5)
+    return timings
+
+
+def benchmark_queries(repeat):
+    """Every library query and the dashboard queries over the whole date range."""
+    start, end, regions = hrdb.sales_filter_options()
+    timings = {}
+    for query in hrdb.LIBRARY_QUERIES:
+        timings[f'query.{query.__name__}'] = _timed(query, repeat=repeat)
+    dashboard = {
+        'sales_filter_options': (),
+        'sales_summary': (start, end, regions[:2]),
+        'daily_sales': (start, end, regions[:2]),
+        'region_daily_sales': (start, end),
+        'state_sales': (start, end),
+        'filtered_sales': (['TotalAmount', 'CustomerID', 'ProductID'], start, end, regions[:2]),
+        'sales_histogram': ('CustomerID', start, end, regions[:2]),
+    }
+    for name, args in dashboard.items():
+        timings[f'query.{name}'] = _timed(getattr(hrdb, name), *args, repeat=repeat)
+    return timings
+
+
+def benchmark_callbacks(repeat):
+    """
+    Each page callback called directly: cold (data and summaries reloaded),
+    warm (data cached, figure cache bypassed) and through the figure cache.
+    """
+    import figure_cache
+    from pages import overview, sales_by_region, top_customers, best_selling_products
+
+    start, end, regions = hrdb.sales_filter_options()
+    callbacks = {
+        'overview.update_graphs_and_cards': (overview.update_graphs_and_cards, (start, end, regions[:2])),
+        'sales_by_region.update_graphs': (sales_by_region.update_graphs, (start, end)),
+        'top_customers.update_top_customers': (top_customers.update_top_customers, (10,)),
+        'best_selling_products.update_top_products': (best_selling_products.update_top_products, (10,)),
+    }
+
+    def cold():
+        hrdb.invalidate_data_cache()
+        top_customers.customer_summaries.cache_clear()
+        best_selling_products.product_summaries.cache_clear()
+
+    timings = {}
+    for name, (callback, args) in callbacks.items():
+        uncached = getattr(callback, '__wrapped__', callback)
+        timings[f'callback.{name}.cold'] = _timed(uncached, *args, repeat=repeat, setup=cold)
+        timings[f'callback.{name}'] = _timed(uncached, *args, repeat=repeat)
+        figure_cache.get_cache().clear()
+        callback(*args)
+        timings[f'callback.{name}.figure_cache'] = _timed(callback, *args, repeat=repeat)
+    return timings
+
+
+def _reset_caches():
+    import figure_cache
+    hrdb.invalidate_data_cache()
+    figure_cache.get_cache().clear()
+
+
+def benchmark_size(size, workdir, seed=0, repeat=3):
+    """Generate (or reuse) the dataset, build a fresh database from it and time everything."""
+    rows = parse_size(size)
+    data_dir = os.path.join(workdir, f'data-{size}-{seed}')
+    start = time.perf_counter()
+    customer_csv, sales_csv = write_dataset(data_dir, rows, seed)
+    generate_seconds = time.perf_counter() - start
+
+    # The incremental update appends to the sales CSV, so work on a copy
+    run_dir = tempfile.mkdtemp(prefix=f'run-{size}-', dir=workdir)
+    run_sales_csv = os.path.join(run_dir, 'sales_transactions.csv')
+    shutil.copyfile(sales_csv, run_sales_csv)
+    db = os.path.join(run_dir, 'sales_transactions.db')
+    db_pool.configure(db)
+    # Every fresh database starts at snapshot version 1, nothing may carry over between sizes
+    _reset_caches()
+
+    try:
+        timings = {}
+        timings.update(benchmark_ingest(customer_csv, run_sales_csv, rows, seed))
+        timings.update(benchmark_get_data(db))
+        timings.update(benchmark_queries(repeat))
+        timings.update(benchmark_callbacks(repeat))
+        memory = hrdb.data_memory_report()
+        result = {
+            'rows': rows,
+            'seed': seed,
+            'generate_seconds': generate_seconds,
+            'database_bytes': os.path.getsize(db),
+            'dataset_bytes': int(memory.loc[memory['Column'] == 'TOTAL', 'Bytes'].sum()),
+            'timings': timings,
+        }
+    finally:
+        db_pool.get_pool().close()
+        _reset_caches()
+        shutil.rmtree(run_dir, ignore_errors=True)
+        gc.collect()
+    return result
+
+
+def run(sizes, workdir, seed=0, repeat=3):
+    """Benchmark every size and return the results document."""
+    results = {
+        'commit': _git_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'sizes': {},
+    }
+    for size in sizes:
+        print(f'Benchmarking {size} rows...', file=sys.stderr)
+        results['sizes'][size] = benchmark_size(size, workdir, seed, repeat)
+    return results
+
+
+def compare(baseline, current, ratio=REGRESSION_RATIO):
+    """
+    Print current against baseline timing by timing (best of runs) and return
+    the names of those at least ratio times slower.
+    """
+    regressions = []
+    for size, result in current['sizes'].items():
+        base = baseline['sizes'].get(size)
+        if base is None:
+            continue
+        print(f"\n{size} rows ({baseline.get('commit')} -> {current.get('commit')})")
+        for name, timing in sorted(result['timings'].items()):
+            if name not in base['timings']:
+                continue
+            before, after = base['timings'][name]['min'], timing['min']
+            change = after / before if before else float('inf')
+            flag = ' REGRESSION' if change >= ratio else ''
+            print(f'  {name:<60} {before:10.4f}s {after:10.4f}s {change:7.2f}x{flag}')
+            if flag:
+                regressions.append(f'{size}:{name}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the sales dashboard on synthetic data.')
+    parser.add_argument('--sizes', nargs='+', default=['10k'], help=f"sizes to run: {', '.join(SIZES)} or a row count")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'sales_dashboard_benchmarks'))
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='compare two result files instead of running; exits 1 on regressions')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        return 1 if compare(baseline, current) else 0
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = run(args.sizes, args.workdir, args.seed, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,174 +1,398 @@
-# -*- coding: utf-8 -*-
-"""
-Created on Fri Jul  5 14:34:20 2024
-
-@author: Joseph.Behan
-
-
-"""
-
-import csv
-import sqlite3
-import glob
-import os
-import pySQL_library as hrdb
-import pandas as pd
-import time
-import requests
-import os
-
-
-
-db_name = 'data/sales_transactions.db'
-customer_csv = 'data/customer_details.csv'
-sales_csv = 'data/sales_transactions.csv'
-
-
-###############################################################################
-
-# This section is placed to allow for downloading directly from Ravi's address.
-# In the real world, I would do a check of the data, and just download new data.
-
-
-customer_csv_url = 'https://github.com/Ravi-Pratap/InsightsDevRole-challenge/blob/98427b5e4ef438d96d6b988d7068e151fa7d94cf/customer_details.csv'  # Update 'customer_details.csv' to the actual path
-sales_csv_url = 'https://github.com/Ravi-Pratap/InsightsDevRole-challenge/blob/98427b5e4ef438d96d6b988d7068e151fa7d94cf/sales_transactions.csv'  # Update 'sales_transactions.csv' to the actual path
-
-
-def url_exists(url):
-    try:
-        response = requests.head(url, verify=False)
-        return response.status_code == 200
-    except requests.RequestException as e:
-        print(f"Error checking URL {url}: {e}")
-        return False
-
-def download_file(url, local_filename):
-    # Check if the URL exists
-    if not url_exists(url):
-        print(f"URL {url} does not exist or is not accessible. Skipping download.")
-        return None
-    
-    # Download the file if the URL is accessible
-    with requests.get(url, stream=True, verify=False) as r:
-        r.raise_for_status()
-        with open(local_filename, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
-    
-    print(f"Downloaded {local_filename} from {url}.")
-    return local_filename
-
-# Download the files
-download_file(customer_csv_url, customer_csv)
-download_file(sales_csv_url, sales_csv)
-
-
-
-###############################################################################
-
-# ETL and Update
-
-###############################################################################
-if not os.path.exists(db_name): 
-    # Extract data from csv into sql tables
-
-    conn = sqlite3.connect(db_name)
-    hrdb.create_customerdetails_table(customer_csv, conn)  # Update 'customer_details.csv' to the actual path
-    hrdb.create_salesdetails_table(sales_csv, conn)  # Update 'sales_transactions.csv' to the actual path
-    
-    # Apply Transformation
-    hrdb.transform_data(conn)
-
-    # Print table contents
-    hrdb.print_table_contents(conn, 'customerdetails')
-    hrdb.print_table_contents(conn, 'salesdetails')
-
-    conn.commit()
-    conn.close()
-else:
-    print(f"Database {db_name} already exists.")
-    conn = sqlite3.connect(db_name)
-    
-    # Update the database with new rows from the CSV files
-    hrdb.update_database_from_csv(conn, customer_csv, sales_csv)
-
-    # Apply transformation
-    hrdb.transform_data(conn)
-
-    # Print table contents after transformation
-    hrdb.print_table_contents(conn, 'salesdetails')
-
-    conn.commit()
-    conn.close()
-
-
-# Data Loading and Verification
-transformed_data = hrdb.query_database("SELECT * FROM salesdetails LIMIT 10")
-print("Transformed Data (First 10 Rows):")
-print(transformed_data)
-
-
-
-
-
-
-
-
-
-
-
-
-"""
-
-1 - Extract all sales data for the last quarter.
-
-"""
-
-sales_last_quarter = hrdb.extract_sales_last_quarter()
-
-
-print("Sales Data for the Last Quarter:")
-print(sales_last_quarter)
-
-
-"""
-
-2 - Calculate the total sales amount per region.
-
-"""
-
-total_sales_per_region = hrdb.calculate_total_sales_per_region()
-print("\nTotal Sales Amount per Region:")
-print(total_sales_per_region)
-
-"""
-
-3 - Join the sales data with a customer details table to find the total sales amount per customer.
-
-"""
-
-total_sales_per_customer_df = hrdb.total_sales_per_customer()
-print("\nTotal Sales Amount per Customer:")
-print(total_sales_per_customer_df)
-
-"""
-
-4- Retrieve the top 10 products by sales amount in the last month.
-
-"""
-
-top_10_products_last_month = hrdb.top_10_products_last_month()
-print(top_10_products_last_month)
-
-
-"""
-
-5 - Identify customers who have not made a purchase in the last six months using a subquery.
-
-"""
-
-customers_no_purchase_last_six_months = hrdb.customers_no_purchase_last_six_months()
-print(customers_no_purchase_last_six_months)
-
-
-
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Jul  5 14:34:20 2024
+
+@author: Joseph.Behan
+
+The ETL: downloads the customer and sales CSV exports and creates or updates
+the SQLite database (and its columnar snapshot) from them. Importing it does
+nothing; refresh() runs a refresh and returns statistics about it.
+
+    python database.py                  # refresh the default database
+    python database.py --full --demo    # rebuild it, then run the assessment queries
+
+"""
+
+import csv
+import sqlite3
+import glob
+import os
+import pySQL_library as hrdb
+import pandas as pd
+import time
+import requests
+import os
+import hashlib
+import json
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import db_pool
+
+
+customer_csv = 'data/customer_details.csv'
+sales_csv = 'data/sales_transactions.csv'
+
+# The local CSV of each source refresh() reads
+DEFAULT_SOURCES = {'customers': customer_csv, 'sales': sales_csv}
+
+
+###############################################################################
+
+# This section is placed to allow for downloading directly from Ravi's address.
+# In the real world, I would do a check of the data, and just download new data.
+
+
+customer_csv_url = 'https://github.com/Ravi-Pratap/InsightsDevRole-challenge/blob/98427b5e4ef438d96d6b988d7068e151fa7d94cf/customer_details.csv'  # Update 'customer_details.csv' to the actual path
+sales_csv_url = 'https://github.com/Ravi-Pratap/InsightsDevRole-challenge/blob/98427b5e4ef438d96d6b988d7068e151fa7d94cf/sales_transactions.csv'  # Update 'sales_transactions.csv' to the actual path
+
+SOURCE_URLS = {'customers': customer_csv_url, 'sales': sales_csv_url}
+
+
+# Point the downloads at another server with ETL_SOURCE_URL, e.g. a local stand-in
+# serving the two CSVs for testing:
+#   python -m http.server 8000 --directory some/dir   then   ETL_SOURCE_URL=http://127.0.0.1:8000
+SOURCE_URL_ENV = 'ETL_SOURCE_URL'
+
+# The exports are tens of MB, so read them in far larger pieces than requests' default
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+
+
+def source_urls(sources=None, base_url=None):
+    """{local csv path: url} for every source, from base_url or ETL_SOURCE_URL when set."""
+    sources = sources or DEFAULT_SOURCES
+    base_url = base_url or os.environ.get(SOURCE_URL_ENV)
+    if base_url:
+        return {path: f"{base_url.rstrip('/')}/{os.path.basename(path)}" for path in sources.values()}
+    return {path: SOURCE_URLS[name] for name, path in sources.items()}
+
+
+def _source_state_path(db_path):
+    # Kept next to the database, as it records what that database was built from
+    return f'{os.path.splitext(db_path)[0]}.sources.json'
+
+
+def load_source_state(db_path):
+    """Per source: validators from the last download and hashes of what was downloaded and ingested."""
+    try:
+        with open(_source_state_path(db_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_source_state(state, db_path):
+    path = _source_state_path(db_path)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def file_sha256(path, entry):
+    """
+    sha256 of a local file, or None if it does not exist. The hash recorded in
+    entry is reused while the file's size and mtime are unchanged, so unchanged
+    files are not re-read; entry is updated otherwise.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns and entry.get('sha256'):
+        return entry['sha256']
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=digest.hexdigest())
+    return entry['sha256']
+
+
+def download_file(url, local_filename, entry=None, session=None):
+    """
+    Download url to local_filename unless it is unchanged, updating entry (the
+    source's state). Returns 'downloaded', 'not_modified', 'unchanged' or 'failed'.
+
+    The request is conditional (If-None-Match / If-Modified-Since) while the local
+    file is still the one last downloaded from url. A full download whose content
+    hashes the same as the local file is discarded, leaving the file untouched.
+    On failure the local file is kept as it is.
+    """
+    entry = entry if entry is not None else {}
+    local_sha256 = file_sha256(local_filename, entry)
+    headers = {}
+    if local_sha256 is not None and entry.get('url') == url and entry.get('downloaded_sha256') == local_sha256:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    partial = local_filename + '.part'
+    try:
+        with (session or requests).get(url, headers=headers, stream=True, verify=False, timeout=DOWNLOAD_TIMEOUT) as r:
+            if r.status_code == 304:
+                print(f"{local_filename} is unchanged at {url}.")
+                return 'not_modified'
+            r.raise_for_status()
+            # An HTML page (e.g. a repository's file viewer) must never replace a CSV
+            if r.headers.get('Content-Type', '').startswith('text/html'):
+                raise requests.RequestException(f"{url} returned an HTML page, not a CSV file")
+            digest = hashlib.sha256()
+            with open(partial, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+            validators = {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
+    except (requests.RequestException, OSError) as e:
+        print(f"Could not download {url}: {e}. Keeping the local {local_filename}.")
+        if os.path.exists(partial):
+            os.remove(partial)
+        return 'failed'
+
+    sha256 = digest.hexdigest()
+    entry.update(validators, url=url, downloaded_sha256=sha256)
+    if sha256 == local_sha256:
+        os.remove(partial)
+        print(f"{local_filename} is unchanged at {url}.")
+        return 'unchanged'
+    os.replace(partial, local_filename)
+    file_sha256(local_filename, entry)
+    print(f"Downloaded {local_filename} from {url}.")
+    return 'downloaded'
+
+
+def download_sources(state, urls):
+    """Download every {local csv path: url} concurrently. Updates state and returns {local csv path: status}."""
+
+    def fetch(path):
+        with requests.Session() as session:
+            return download_file(urls[path], path, state.setdefault(path, {}), session)
+
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        return dict(zip(urls, executor.map(fetch, urls)))
+
+
+def sources_ingested(state, paths):
+    """True when every local CSV is byte for byte the one the database was last refreshed from."""
+    for path in paths:
+        entry = state.setdefault(path, {})
+        sha256 = file_sha256(path, entry)
+        if sha256 is None or entry.get('ingested_sha256') != sha256:
+            return False
+    return True
+
+
+###############################################################################
+
+# ETL and Update
+
+###############################################################################
+@contextmanager
+def _stage(timings, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def _ingest(pool, sources, create, stats):
+    """Load (create=True) or update the tables from the CSVs, then write the snapshot."""
+    customer_csv, sales_csv = sources['customers'], sources['sales']
+    timings = stats['timings']
+
+    with pool.writer() as conn:
+        if create:
+            # Extract data from csv into sql tables
+            with _stage(timings, 'ingest'):
+                hrdb.create_customerdetails_table(customer_csv, conn, stats['tables'])
+                hrdb.create_salesdetails_table(sales_csv, conn, stats['tables'])
+
+            # Apply Transformation
+            with _stage(timings, 'transform'):
+                hrdb.transform_data(conn)
+
+            # Build the daily rollups the dashboards read from
+            with _stage(timings, 'rollups'):
+                hrdb.rebuild_rollups(conn)
+        else:
+            print(f"Database {pool.db_path} already exists.")
+
+            # Convert dates and add indexes on databases built by an older ETL
+            with _stage(timings, 'migrate'):
+                hrdb.migrate_salesdetails(conn)
+
+            # Update the database with new rows from the CSV files
+            with _stage(timings, 'ingest'):
+                hrdb.update_database_from_csv(conn, customer_csv, sales_csv, stats=stats['tables'])
+
+            # Apply transformation to the rows not transformed yet: the new ones, and
+            # any committed by an earlier refresh that failed before this step
+            with _stage(timings, 'transform'):
+                hrdb.transform_data(conn)
+
+            # Add the rows not rolled up yet to the daily rollups
+            with _stage(timings, 'rollups'):
+                hrdb.update_rollups(conn)
+
+    # Write the columnar snapshot get_data() loads from, once the refresh is committed
+    with pool.writer() as conn, _stage(timings, 'snapshot'):
+        hrdb.write_snapshot(conn, pool.db_path)
+
+
+def refresh(sources=None, db_path=None, full=False, download=True):
+    """
+    Bring the database at db_path up to date with the CSV sources and return
+    statistics about the run.
+
+    sources maps 'customers' and 'sales' to local CSV paths (DEFAULT_SOURCES for
+    any not given), and db_path defaults to the shared pool's database. With
+    download the sources are fetched first, see download_sources().
+
+    The tables are created from the CSVs when the database does not exist or full
+    is set, and updated with their new rows otherwise. Nothing is written when the
+    CSVs are the ones already ingested and the snapshot is current.
+
+    Returns a JSON-serialisable dict:
+        db_path, full, updated
+        downloads   {local csv path: download status}, empty without download
+        tables      {table: {'read', 'inserted', 'skipped'}} for the CSV rows
+        timings     seconds per stage (download, migrate, ingest, transform,
+                    rollups, snapshot) and in total
+    """
+    start = time.perf_counter()
+    sources = dict(DEFAULT_SOURCES, **(sources or {}))
+    pool = db_pool.get_pool()
+    owned = db_path is not None and os.path.abspath(db_path) != os.path.abspath(pool.db_path)
+    if owned:
+        pool = db_pool.ConnectionPool(db_path)
+
+    stats = {'db_path': pool.db_path, 'full': full, 'updated': False, 'downloads': {}, 'tables': {}, 'timings': {}}
+    try:
+        state = load_source_state(pool.db_path)
+        if download:
+            with _stage(stats['timings'], 'download'):
+                stats['downloads'] = download_sources(state, source_urls(sources))
+
+        paths = list(sources.values())
+        exists = os.path.exists(pool.db_path)
+        if (not full and exists and sources_ingested(state, paths)
+                and (hrdb.feather is None or hrdb.snapshot_is_fresh(pool.db_path))):
+            print(f"Sources unchanged since the last refresh of {pool.db_path}.")
+        else:
+            _ingest(pool, sources, full or not exists, stats)
+            for path in paths:
+                entry = state.setdefault(path, {})
+                entry['ingested_sha256'] = file_sha256(path, entry)
+            stats['updated'] = True
+        save_source_state(state, pool.db_path)
+    finally:
+        if owned:
+            pool.close()
+
+    stats['timings']['total'] = time.perf_counter() - start
+    return stats
+
+
+def refresh_database():
+    """Download the latest CSV files and create or update the shared database from them. Returns refresh()'s stats."""
+    return refresh()
+
+
+###############################################################################
+
+# Assessment queries
+
+###############################################################################
+def run_demo_queries():
+    """Print a sample of the transformed data and the results of the five assessment queries."""
+    # Data Loading and Verification
+    transformed_data = hrdb.query_database("SELECT * FROM salesdetails LIMIT 10")
+    print("Transformed Data (First 10 Rows):")
+    print(transformed_data)
+
+
+    """
+
+    1 - Extract all sales data for the last quarter.
+
+    """
+
+    sales_last_quarter = hrdb.extract_sales_last_quarter()
+
+
+    print("Sales Data for the Last Quarter:")
+    print(sales_last_quarter)
+
+
+    """
+
+    2 - Calculate the total sales amount per region.
+
+    """
+
+    total_sales_per_region = hrdb.calculate_total_sales_per_region()
+    print("\nTotal Sales Amount per Region:")
+    print(total_sales_per_region)
+
+    """
+
+    3 - Join the sales data with a customer details table to find the total sales amount per customer.
+
+    """
+
+    total_sales_per_customer_df = hrdb.total_sales_per_customer()
+    print("\nTotal Sales Amount per Customer:")
+    print(total_sales_per_customer_df)
+
+    """
+
+    4- Retrieve the top 10 products by sales amount in the last month.
+
+    """
+
+    top_10_products_last_month = hrdb.top_10_products_last_month()
+    print(top_10_products_last_month)
+
+
+    """
+
+    5 - Identify customers who have not made a purchase in the last six months using a subquery.
+
+    """
+
+    customers_no_purchase_last_six_months = hrdb.customers_no_purchase_last_six_months()
+    print(customers_no_purchase_last_six_months)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create or update the sales database from the CSV exports.')
+    parser.add_argument('--db', help='database file (default: SALES_DB_PATH or data/sales_transactions.db)')
+    parser.add_argument('--customers', default=customer_csv, help='local customer details CSV')
+    parser.add_argument('--sales', default=sales_csv, help='local sales transactions CSV')
+    parser.add_argument('--full', action='store_true', help='rebuild the tables from the CSVs instead of updating them')
+    parser.add_argument('--no-download', action='store_true', help='use the local CSVs as they are')
+    parser.add_argument('--dump', action='store_true', help='print the contents of both tables afterwards')
+    parser.add_argument('--demo', action='store_true', help='run the five assessment queries afterwards')
+    args = parser.parse_args(argv)
+
+    if args.db:
+        # The dump and demo queries read through the shared pool, so point it at the same file
+        db_pool.configure(args.db)
+    stats = refresh({'customers': args.customers, 'sales': args.sales}, full=args.full, download=not args.no_download)
+    print(json.dumps(stats, indent=2))
+
+    if args.dump:
+        conn = db_pool.get_pool().reader()
+        for table_name in ('customerdetails', 'salesdetails'):
+            hrdb.print_table_contents(conn, table_name)
+    if args.demo:
+        run_demo_queries()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
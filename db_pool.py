@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Shared SQLite connection manager. Every thread gets its own long lived read
+connection and all writes go through a single writer connection, so queries no
+longer pay for connection setup, schema parsing and a cold page cache each time.
+
+The database path defaults to data/sales_transactions.db and can be changed with
+the SALES_DB_PATH environment variable or configure().
+
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+DB_PATH = os.environ.get('SALES_DB_PATH', 'data/sales_transactions.db')
+
+# Per-connection tuning. cache_size is negative to mean KiB rather than pages.
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE = -8192
+BUSY_TIMEOUT = 30
+
+# Compiled statements kept per connection, keyed by SQL text. Queries bind their
+# values as parameters, so each distinct query is only ever compiled once.
+STATEMENT_CACHE_SIZE = 256
+
+# Functions run with each pool before it hands out its first read connection,
+# see on_open(). pySQL_library registers one that upgrades older databases.
+_open_hooks = []
+
+
+class ConnectionPool:
+    """Per-thread read connections plus one shared writer connection for a SQLite file."""
+
+    def __init__(self, db_path=DB_PATH, mmap_size=MMAP_SIZE, cache_size=CACHE_SIZE, timeout=BUSY_TIMEOUT):
+        self.db_path = db_path
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.timeout = timeout
+
+        self._local = threading.local()
+        self._readers = {}
+        self._readers_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._opened = False
+        self._opening = False
+        self._open_lock = threading.RLock()
+
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'reader_hits': 0,
+            'reader_misses': 0,
+            'writer_acquisitions': 0,
+            'writer_wait_seconds': 0.0,
+            'writer_max_wait_seconds': 0.0,
+            'connect_seconds': 0.0,
+        }
+
+    def _connect(self, writer=False):
+        start = time.perf_counter()
+        # Connections are only used by their owning thread (or under the writer lock),
+        # but the pool needs to be able to close them from elsewhere.
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        if writer:
+            # WAL is persistent, so readers pick it up once the writer has switched the file over
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute(f'PRAGMA cache_size={int(self.cache_size)}')
+        self._record('connect_seconds', time.perf_counter() - start)
+        return conn
+
+    def _record(self, name, value=1):
+        with self._metrics_lock:
+            self._metrics[name] += value
+
+    def _check_fork(self):
+        # Connections must not cross a fork (e.g. gunicorn preloading the app)
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._readers = {}
+            self._writer = None
+            self._writer_lock = threading.Lock()
+            self._pid = os.getpid()
+
+    def reader(self):
+        """Return this thread's read connection, opening it on first use."""
+        self._check_fork()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._record('reader_hits')
+            return conn
+
+        self._record('reader_misses')
+        self._run_open_hooks()
+        conn = self._connect()
+        conn.execute('PRAGMA query_only=ON')
+        self._local.conn = conn
+        with self._readers_lock:
+            # Close connections left behind by threads that have exited
+            for thread in [t for t in self._readers if not t.is_alive()]:
+                self._readers.pop(thread).close()
+            self._readers[threading.current_thread()] = conn
+        return conn
+
+    def _run_open_hooks(self):
+        # Other threads wait until the hooks are done, so none reads the old schema.
+        # A hook that reads through the pool itself does not run them again.
+        with self._open_lock:
+            if self._opened or self._opening:
+                return
+            self._opening = True
+            try:
+                for hook in _open_hooks:
+                    hook(self)
+                self._opened = True
+            finally:
+                self._opening = False
+
+    @contextmanager
+    def writer(self):
+        """
+        Hold the single writer connection for the duration of the block.
+
+        The transaction is committed when the block exits and rolled back if it raises.
+        """
+        self._check_fork()
+        start = time.perf_counter()
+        with self._writer_lock:
+            waited = time.perf_counter() - start
+            with self._metrics_lock:
+                self._metrics['writer_acquisitions'] += 1
+                self._metrics['writer_wait_seconds'] += waited
+                self._metrics['writer_max_wait_seconds'] = max(self._metrics['writer_max_wait_seconds'], waited)
+
+            if self._writer is None:
+                self._writer = self._connect(writer=True)
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+
+    def metrics(self):
+        """Return a snapshot of the pool counters."""
+        with self._metrics_lock:
+            snapshot = dict(self._metrics)
+        with self._readers_lock:
+            snapshot['open_readers'] = len(self._readers)
+        lookups = snapshot['reader_hits'] + snapshot['reader_misses']
+        snapshot['reader_hit_rate'] = snapshot['reader_hits'] / lookups if lookups else 0.0
+        return snapshot
+
+    def close(self):
+        """Close every connection owned by the pool."""
+        with self._readers_lock:
+            for conn in self._readers.values():
+                conn.close()
+            self._readers = {}
+        self._local = threading.local()
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+def on_open(hook):
+    """
+    Register hook(pool) to run once per pool, before its first read connection is
+    handed out. If it raises, the read fails and the next one runs it again.
+    """
+    _open_hooks.append(hook)
+    return hook
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, creating it for DB_PATH on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(DB_PATH)
+        return _pool
+
+
+def configure(db_path=DB_PATH, **kwargs):
+    """Replace the process-wide pool with one for db_path (closing the old one)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(db_path, **kwargs)
+        return _pool
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Response cache for the page callbacks. Users flip between the same few date
+ranges, region sets and slider values, so each callback result is serialised
+once and kept keyed on the normalised inputs plus the version of the data it
+was built from. A repeat view returns the stored JSON instead of rebuilding the
+figures with plotly.
+
+Entries are held in an LRU bounded by their size in bytes (FIGURE_CACHE_BYTES)
+and can also be written to a local directory (FIGURE_CACHE_DIR), which every
+gunicorn worker shares and which survives restarts.
+
+"""
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from dash import no_update
+from flask import jsonify
+from plotly.io.json import to_json_plotly
+
+import pySQL_library as hrdb
+
+
+FIGURE_CACHE_BYTES = int(os.environ.get('FIGURE_CACHE_BYTES', 32 * 1024 * 1024))
+FIGURE_CACHE_DIR = os.environ.get('FIGURE_CACHE_DIR') or None
+FIGURE_CACHE_DISK_BYTES = int(os.environ.get('FIGURE_CACHE_DISK_BYTES', 256 * 1024 * 1024))
+
+# Date pickers send either '2023-01-01' or '2023-01-01T00:00:00' for the same day
+_MIDNIGHT = re.compile(r'^(\d{4}-\d{2}-\d{2})[T ]00:00:00(\.0+)?$')
+
+# dash.no_update is the only instance; its class is not public
+_NoUpdate = type(no_update)
+
+
+def normalize_input(value):
+    """
+    Reduce a callback input to a canonical, JSON-able form: midnight timestamps
+    become dates and lists (the region filters) become sorted, de-duplicated lists.
+    """
+    if isinstance(value, str):
+        match = _MIDNIGHT.match(value)
+        return match.group(1) if match else value
+    if isinstance(value, (list, tuple)):
+        items = {}
+        for item in value:
+            item = normalize_input(item)
+            items[json.dumps(item, sort_keys=True, default=str)] = item
+        return [items[key] for key in sorted(items)]
+    if isinstance(value, dict):
+        return {key: normalize_input(item) for key, item in value.items()}
+    return value
+
+
+class FigureCache:
+    """LRU of serialised callback results bounded by bytes, with an optional disk directory behind it."""
+
+    def __init__(self, max_bytes=FIGURE_CACHE_BYTES, directory=FIGURE_CACHE_DIR, max_disk_bytes=FIGURE_CACHE_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'uncacheable': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key):
+        """Return the stored JSON bytes for key, or None."""
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return body
+
+        if self.directory:
+            try:
+                with open(self._disk_path(key), 'rb') as f:
+                    body = f.read()
+            except OSError:
+                pass
+            else:
+                self._count('disk_hits')
+                self._remember(key, body)
+                return body
+
+        self._count('misses')
+        return None
+
+    def _remember(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self._stats['evictions'] += 1
+
+    def put(self, key, body):
+        """Store JSON bytes under key, in memory and (if configured) on disk."""
+        self._remember(key, body)
+        self._count('stores')
+        if self.directory:
+            path = self._disk_path(key)
+            # Written aside and swapped in, other workers may be reading it
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+            self._prune_disk()
+
+    def _prune_disk(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Drop every entry, in memory and on disk."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        if self.directory:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.json'):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass  # Already removed, e.g. by another worker's _prune_disk()
+
+    def stats(self):
+        """Counters plus hit rate, entry count and bytes held in memory."""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['entries'] = len(self._entries)
+            snapshot['bytes'] = self._size
+        snapshot['max_bytes'] = self.max_bytes
+        lookups = snapshot['hits'] + snapshot['disk_hits'] + snapshot['misses']
+        snapshot['hit_rate'] = (snapshot['hits'] + snapshot['disk_hits']) / lookups if lookups else 0.0
+        return snapshot
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide cache, created from the FIGURE_CACHE_* settings on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FigureCache()
+        return _cache
+
+
+def cached_callback(version=hrdb.data_version):
+    """
+    Decorator for page callbacks. Place it under @app.callback.
+
+    version is called on every request and must return a token for the data the
+    callback reads: hrdb.data_version for callbacks built on get_data(), and
+    hrdb.database_version for those querying the database directly.
+    Results holding dash.no_update (alone or as one of several outputs) depend on
+    what the page already shows, so they are returned uncached, as are results
+    that cannot be serialised.
+    """
+    def decorator(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            key_source = json.dumps([name, [normalize_input(arg) for arg in args], version()], sort_keys=True, default=str)
+            key = hashlib.sha1(key_source.encode('utf-8')).hexdigest()
+
+            cache = get_cache()
+            body = cache.get(key)
+            if body is not None:
+                # Plain lists and dicts, Dash re-encodes them without touching plotly
+                return json.loads(body)
+
+            result = func(*args)
+            if _has_no_update(result):
+                cache._count('uncacheable')
+                return result
+            try:
+                body = to_json_plotly(result).encode('utf-8')
+            except (TypeError, ValueError):
+                cache._count('uncacheable')
+                return result
+            cache.put(key, body)
+            return result
+
+        return wrapper
+    return decorator
+
+
+def _has_no_update(result):
+    if isinstance(result, (list, tuple)):
+        return any(isinstance(item, _NoUpdate) for item in result)
+    return isinstance(result, _NoUpdate)
+
+
+def register_stats_route(app):
+    """Expose the cache counters as JSON at /figure-cache-stats on the Flask server."""
+    def figure_cache_stats():
+        return jsonify(get_cache().stats())
+
+    app.server.add_url_rule('/figure-cache-stats', 'figure_cache_stats', figure_cache_stats)
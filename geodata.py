@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Australian state boundaries for the choropleth map. The geojson is read once at
+startup, simplified for dashboard zoom levels, serialised once and then served
+to the browser as a cacheable static file. The map figures only reference its
+URL, so the geometry is no longer shipped with every callback response.
+
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+from flask import Response, request
+
+
+GEOJSON_PATH = 'data/australia.geojson'
+GEOJSON_ROUTE = '/geojson/australia.geojson'
+
+# Simplification tolerance in degrees (0.01 is roughly 1 km). Set to 0 to ship the full geometry.
+GEOJSON_TOLERANCE = float(os.environ.get('GEOJSON_TOLERANCE', '0.01'))
+
+# Coordinates are rounded to this many decimal places when serialised.
+GEOJSON_PRECISION = 4
+
+_geojson = {}
+
+
+def simplify_ring(ring, tolerance):
+    """Simplify one closed ring of [lon, lat] points with the Douglas-Peucker algorithm."""
+    points = np.asarray(ring, dtype=float)
+    if tolerance <= 0 or len(points) <= 4:
+        return points
+
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end <= start + 1:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(segment[0], segment[1])
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return points[keep]
+
+
+def _simplify_polygon(polygon, tolerance):
+    rings = []
+    for ring in polygon:
+        simplified = simplify_ring(ring, tolerance)
+        # A ring needs at least 4 points (3 corners plus the closing point)
+        if len(simplified) >= 4:
+            rings.append(np.round(simplified, GEOJSON_PRECISION).tolist())
+        elif not rings:
+            return None  # The outer ring collapsed, drop the whole polygon
+    return rings
+
+
+def simplify_geojson(geojson, tolerance=GEOJSON_TOLERANCE):
+    """Return a copy of a Polygon/MultiPolygon FeatureCollection with simplified geometry."""
+    features = []
+    for feature in geojson['features']:
+        geometry = feature['geometry']
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        simplified = [p for p in (_simplify_polygon(polygon, tolerance) for polygon in polygons) if p]
+        if simplified:
+            geometry = {'type': 'MultiPolygon', 'coordinates': simplified}
+        features.append(dict(feature, geometry=geometry))
+    return dict(geojson, features=features)
+
+
+def load_geojson(path=GEOJSON_PATH, tolerance=GEOJSON_TOLERANCE):
+    """Load, simplify and serialise the geojson once. Returns (geojson, body, etag)."""
+    key = (path, tolerance)
+    if key not in _geojson:
+        with open(path, 'r') as f:
+            geojson = json.load(f)
+        if tolerance > 0:
+            geojson = simplify_geojson(geojson, tolerance)
+        body = json.dumps(geojson, separators=(',', ':')).encode('utf-8')
+        _geojson[key] = (geojson, body, hashlib.sha1(body).hexdigest())
+    return _geojson[key]
+
+
+def register_geojson_route(app, path=GEOJSON_PATH, tolerance=GEOJSON_TOLERANCE, route=GEOJSON_ROUTE):
+    """Serve the pre-serialised geojson from the Flask server and return its URL for the figures."""
+    _, body, etag = load_geojson(path, tolerance)
+
+    if route not in app.server.view_functions:
+        def serve_geojson():
+            response = Response(body, mimetype='application/geo+json')
+            response.set_etag(etag)
+            response.cache_control.public = True
+            response.cache_control.max_age = 86400
+            return response.make_conditional(request)
+
+        app.server.add_url_rule(route, route, serve_geojson)
+
+    return app.get_relative_path(route)
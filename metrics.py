@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Callback latency instrumentation. Every Dash callback request is timed on the
+Flask server, split into the time spent loading data (get_data() and the SQL
+queries, marked with timed_stage('data')) and the rest of the callback, which is
+building and serialising the figures. Response sizes are recorded too.
+
+The numbers are served in the Prometheus text format at /metrics, together with
+the connection pool and figure cache counters. Callbacks slower than
+SLOW_CALLBACK_SECONDS are written to the 'sales_dashboard.slow_callbacks' log
+(and to SLOW_CALLBACK_LOG if that file is set).
+
+Counters are kept per process, so with several gunicorn workers each scrape
+sees the worker that answered it.
+
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+
+SLOW_CALLBACK_SECONDS = float(os.environ.get('SLOW_CALLBACK_SECONDS', '1.0'))
+SLOW_CALLBACK_LOG = os.environ.get('SLOW_CALLBACK_LOG') or None
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (1024, 10 * 1024, 50 * 1024, 100 * 1024, 500 * 1024, 1024 ** 2, 5 * 1024 ** 2)
+
+slow_log = logging.getLogger('sales_dashboard.slow_callbacks')
+if SLOW_CALLBACK_LOG:
+    _handler = logging.FileHandler(SLOW_CALLBACK_LOG)
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    slow_log.addHandler(_handler)
+    slow_log.setLevel(logging.WARNING)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label value, in the shape Prometheus expects."""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label, value):
+        with self._lock:
+            series = self._series.setdefault(label, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self, label_name):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label, series in sorted(self._series.items()):
+                labels = f'{label_name}="{_escape(label)}"'
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound:g}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{{labels}}} {series["sum"]:.6f}')
+                lines.append(f'{self.name}_count{{{labels}}} {series["count"]}')
+        return lines
+
+
+class Counter:
+    """Monotonic count per label value."""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def inc(self, label):
+        with self._lock:
+            self._values[label] += 1
+
+    def render(self, label_name):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{{{label_name}="{_escape(label)}"}} {value}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+callback_seconds = Histogram('dash_callback_duration_seconds', 'Wall time of the callback request.', SECONDS_BUCKETS)
+data_seconds = Histogram('dash_callback_data_seconds', 'Time spent in get_data() and SQL queries.', SECONDS_BUCKETS)
+figure_seconds = Histogram('dash_callback_figure_seconds', 'Time outside data loading, building and serialising figures.', SECONDS_BUCKETS)
+response_bytes = Histogram('dash_callback_response_bytes', 'Size of the callback response body.', BYTES_BUCKETS)
+callback_errors = Counter('dash_callback_errors_total', 'Callback requests that failed.')
+slow_callbacks = Counter('dash_slow_callbacks_total', f'Callback requests slower than {SLOW_CALLBACK_SECONDS:g} seconds.')
+
+HISTOGRAMS = (callback_seconds, data_seconds, figure_seconds, response_bytes)
+COUNTERS = (callback_errors, slow_callbacks)
+
+
+# The stages of the request currently handled by this thread, None outside callback requests
+_local = threading.local()
+
+
+def timed_stage(stage):
+    """
+    Decorator adding a function's wall time to the current callback request's
+    stage. Nested timed calls of the same stage count once, outside requests it is a no-op.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            record = getattr(_local, 'record', None)
+            if record is None or stage in record['active']:
+                return func(*args, **kwargs)
+            record['active'].add(stage)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record['stages'][stage] += time.perf_counter() - start
+                record['active'].discard(stage)
+        return wrapper
+    return decorator
+
+
+def _callback_name(app, payload):
+    output = payload.get('output', '') if isinstance(payload, dict) else ''
+    callback = app.callback_map.get(output, {}).get('callback')
+    if callback is not None:
+        return f'{callback.__module__}.{callback.__name__}'
+    # Not taken from the request, clients must not be able to create new series
+    return 'unknown'
+
+
+def _finish(record, status, size):
+    name = record['name']
+    total = time.perf_counter() - record['start']
+    data = record['stages']['data']
+
+    callback_seconds.observe(name, total)
+    data_seconds.observe(name, data)
+    figure_seconds.observe(name, max(total - data, 0.0))
+    response_bytes.observe(name, size)
+    if status >= 400:
+        callback_errors.inc(name)
+
+    if total >= SLOW_CALLBACK_SECONDS:
+        slow_callbacks.inc(name)
+        slow_log.warning(
+            'slow callback %s: %.3fs (data %.3fs, figures %.3fs, %d bytes, status %d) inputs=%s',
+            name, total, data, total - data, size, status, json.dumps(record['inputs'], default=str)[:500]
+        )
+
+
+def _collector_lines():
+    # Imported here so the library can use timed_stage without the web modules
+    import db_pool
+    import figure_cache
+
+    lines = []
+    pool = db_pool.get_pool().metrics()
+    for key, value in sorted(pool.items()):
+        lines.append(f'# TYPE sqlite_pool_{key} gauge')
+        lines.append(f'sqlite_pool_{key} {value}')
+    cache = figure_cache.get_cache().stats()
+    for key, value in sorted(cache.items()):
+        lines.append(f'# TYPE figure_cache_{key} gauge')
+        lines.append(f'figure_cache_{key} {value}')
+    return lines
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render('callback'))
+    for counter in COUNTERS:
+        lines.extend(counter.render('callback'))
+    lines.extend(_collector_lines())
+    return '\n'.join(lines) + '\n'
+
+
+def register_metrics(app):
+    """Time every Dash callback request on the Flask server and serve /metrics."""
+    from flask import Response, request
+
+    server = app.server
+
+    @server.before_request
+    def start_callback_timer():
+        _local.record = None
+        if request.method == 'POST' and request.path.endswith('_dash-update-component'):
+            payload = request.get_json(silent=True)
+            _local.record = {
+                'name': _callback_name(app, payload),
+                'inputs': [item.get('value') for item in (payload or {}).get('inputs', []) if isinstance(item, dict)],
+                'start': time.perf_counter(),
+                'stages': defaultdict(float),
+                'active': set(),
+            }
+
+    @server.after_request
+    def finish_callback_timer(response):
+        record = getattr(_local, 'record', None)
+        if record is not None:
+            _local.record = None
+            _finish(record, response.status_code, response.calculate_content_length() or 0)
+        return response
+
+    @server.teardown_request
+    def abandon_callback_timer(exc):
+        # after_request does not run when the request raised
+        record = getattr(_local, 'record', None)
+        if record is not None:
+            _local.record = None
+            _finish(record, 500, 0)
+
+    def serve_metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    server.add_url_rule('/metrics', 'metrics', serve_metrics)
@@ -1,21 +1,22 @@
-# -*- coding: utf-8 -*-
-"""
-Created on Sat Jul  6 07:41:39 2024
-
-@author: Joseph.Behan
-"""
-
-# pages/__init__.py
-from .overview import layout as overview_layout
-from .sales_by_region import layout as sales_by_region_layout
-from .top_customers import layout as top_customers_layout
-from .best_selling_products import layout as best_selling_products_layout
-
-__all__ = [
-    'overview_layout',
-    'sales_by_region_layout',
-    'top_customers_layout',
-    'best_selling_products_layout'
-]
-
-
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Jul  6 07:41:39 2024
+
+@author: Joseph.Behan
+"""
+
+# pages/__init__.py
+# Layouts are functions, called per request by app.display_page
+from .overview import create_layout as overview_layout
+from .sales_by_region import create_layout as sales_by_region_layout
+from .top_customers import create_layout as top_customers_layout
+from .best_selling_products import create_product_layout as best_selling_products_layout
+
+__all__ = [
+    'overview_layout',
+    'sales_by_region_layout',
+    'top_customers_layout',
+    'best_selling_products_layout'
+]
+
+
@@ -1,229 +1,223 @@
-# -*- coding: utf-8 -*-
-"""
-Created on Sat Jul  6 07:37:44 2024
-
-@author: Joseph.Behan
-
-Landing page designed for a broadbrush overview of the data in its entirety.
-
-"""
-import dash_bootstrap_components as dbc
-from dash import dcc, html
-import plotly.express as px
-import sqlite3
-import pandas as pd
-from dash.dependencies import Input, Output
-from server import app, rio_tinto_colors
-import pySQL_library as hrdb
-
-
-# Function to create the layout
-def create_layout():
-    sales_df, customers_df = hrdb.get_data()
-
-    total_sales = sales_df['TotalAmount'].sum()
-    total_customers = sales_df['CustomerID'].nunique()
-    total_products_sold = sales_df['Quantity'].sum()
-    average_order_value = total_sales / sales_df['TransactionID'].nunique()
-
-    # Sales Over Time
-    sales_over_time = sales_df.groupby('Date').sum()['TotalAmount'].reset_index()
-    fig_sales_over_time = px.line(sales_over_time, x='Date', y='TotalAmount', title='Sales Over Time', template='plotly_white', color_discrete_sequence=[rio_tinto_colors['line']])
-
-    layout = html.Div(
-        [
-            dbc.Row(
-                [
-                    dbc.Col(
-                        html.Div([
-                            html.H4("Filter by Time Frame", className='text-center'),
-                            dcc.DatePickerRange(
-                                id='date-picker-range',
-                                start_date=sales_df['Date'].min().date(),
-                                end_date=sales_df['Date'].max().date(),
-                                display_format='YYYY-MM-DD',
-                                style={"marginBottom": "10px", "textAlign": "center"}
-                            ),
-                        ], style={"textAlign": "center"}),
-                        width=6,
-                    ),
-                    dbc.Col(
-                        html.Div([
-                            html.H4("Filter by Region", className='text-center'),
-                            dcc.Checklist(
-                                id='region-filter',
-                                options=[{'label': region, 'value': region} for region in sales_df['Region'].unique()],
-                                value=sales_df['Region'].unique(),
-                                inline=True,
-                                labelStyle={"margin": "10px"},
-                                style={"textAlign": "center"}
-                            )
-                        ], style={"textAlign": "center"}),
-                        width=6,
-                    ),
-                ],
-                className="mb-4",
-                style={"height": "15vh"}
-            ),
-            dbc.Row(
-                [
-                    dbc.Col(
-                        dbc.Card(
-                            dbc.CardBody(
-                                [
-                                    html.H5("Total Sales", className="card-title text-center", style={"fontSize": "20px"}),
-                                    html.P(id="total-sales-card", className="card-text text-center", style={"fontSize": "6rem", "color": "#D22630"}),
-                                ]
-                            ),
-                        ),
-                        width=3,
-                    ),
-                    dbc.Col(
-                        dbc.Card(
-                            dbc.CardBody(
-                                [
-                                    html.H5("Total Customers", className="card-title text-center", style={"fontSize": "20px"}),
-                                    html.P(id="total-customers-card", className="card-text text-center", style={"fontSize": "6rem", "color": "#D22630"}),
-                                ],
-
-                            ),
-                        ),
-                        width=3,
-                    ),
-                    dbc.Col(
-                        dbc.Card(
-                            dbc.CardBody(
-                                [
-                                    html.H5("Total Products Sold", className="card-title text-center", style={"fontSize": "20px"}),
-                                    html.P(id="total-products-sold-card", className="card-text text-center", style={"fontSize": "6rem", "color": "#D22630"}),
-                                ]
-                            ),
-                        ),
-                        width=3,
-                    ),
-                    dbc.Col(
-                        dbc.Card(
-                            dbc.CardBody(
-                                [
-                                    html.H5("Average Order Value", className="card-title text-center", style={"fontSize": "20px"}),
-                                    html.P(id="average-order-value-card", className="card-text text-center", style={"fontSize": "6rem", "color": "#D22630"}),
-                                ]
-                            ),
-                        ),
-                        width=3,
-                    ),
-                ],
-                className="mb-4",
-            ),
-            dbc.Row(
-                dbc.Col(html.H2("Overview", className='text-center', style={"paddingTop": "20px"}), width=12)
-            ),
-            dbc.Row(
-                [
-                    dbc.Col(
-                        dcc.Graph(id='sales-over-time-graph', figure=fig_sales_over_time),
-                        width=12
-                    ),
-                ],
-                className="mb-4",
-            ),
-            dbc.Row(
-                [
-                    dbc.Col(
-                        dcc.Graph(id='customer-histogram'),
-                        width=6
-                    ),
-                    dbc.Col(
-                        dcc.Graph(id='product-histogram'),
-                        width=6
-                    ),
-                ],
-                style={"height": "40vh"}
-            ),
-        ],
-        style={"height": "100vh", "padding": "10px"}
-    )
-    return layout
-
-# Register the layout function as the page layout
-layout = create_layout()
-
-@app.callback(
-    [Output('customer-histogram', 'figure'),
-     Output('product-histogram', 'figure'),
-     Output('sales-over-time-graph', 'figure'),
-     Output('total-sales-card', 'children'),
-     Output('total-customers-card', 'children'),
-     Output('total-products-sold-card', 'children'),
-     Output('average-order-value-card', 'children')],
-    [Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date'),
-     Input('region-filter', 'value')]
-)
-def update_graphs_and_cards(start_date, end_date, selected_regions):
-    sales_df, _ = hrdb.get_data()
-
-    # Check if the dates are properly parsed
-    if not start_date or not end_date:
-        return {}, {}, {}, "", "", "", ""
-
-    # Ensure dates are in datetime format
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
-
-    # Filter by date range
-    filtered_df = sales_df[(sales_df['Date'] >= start_date) & (sales_df['Date'] <= end_date)]
-
-
-    # Filter by selected regions
-    if selected_regions:
-        filtered_df = filtered_df[filtered_df['Region'].isin(selected_regions)]
-
-    if filtered_df.empty:
-        return {}, {}, {}, "", "", "", ""
-
-    total_sales = filtered_df['TotalAmount'].sum()
-    total_customers = filtered_df['CustomerID'].nunique()
-    total_products_sold = filtered_df['Quantity'].sum()
-    average_order_value = total_sales / filtered_df['TransactionID'].nunique()
-
-    customer_histogram = px.histogram(
-        filtered_df,
-        x='TotalAmount',
-        color='CustomerID',
-        title='Sales Distribution by Customer',
-        template='plotly_white',
-        color_discrete_sequence=px.colors.qualitative.Set1
-    )
-
-    product_histogram = px.histogram(
-        filtered_df,
-        x='TotalAmount',
-        color='ProductID',
-        title='Sales Distribution by Product',
-        template='plotly_white',
-        color_discrete_sequence=px.colors.qualitative.Set1
-    )
-
-    sales_over_time = filtered_df.groupby('Date').sum()['TotalAmount'].reset_index()
-    fig_sales_over_time = px.line(sales_over_time, x='Date', y='TotalAmount', title='Sales Over Time', template='plotly_white', color_discrete_sequence=[rio_tinto_colors['line']])
-
-    return (
-        customer_histogram, 
-        product_histogram, 
-        fig_sales_over_time, 
-        html.P(f"${total_sales:,.2f}", className="card-text text-center", style={"fontSize": "24px"}), 
-        html.P(total_customers, className="card-text text-center", style={"fontSize": "24px"}), 
-        html.P(total_products_sold, className="card-text text-center", style={"fontSize": "24px"}), 
-        html.P(f"${average_order_value:,.2f}", className="card-text text-center", style={"fontSize": "24px"})
-    )
-
-layout = create_layout()
-
-
-
-
-
-
-
-
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Jul  6 07:37:44 2024
+
+@author: Joseph.Behan
+
+Landing page designed for a broadbrush overview of the data in its entirety.
+
+"""
+import dash_bootstrap_components as dbc
+from dash import dcc, html
+import plotly.express as px
+import plotly.graph_objects as go
+import sqlite3
+import pandas as pd
+import numpy as np
+from dash.dependencies import Input, Output
+from server import app, rio_tinto_colors
+import pySQL_library as hrdb
+import figure_cache
+
+
+# Histograms are binned and counted in SQL. Only the most frequent categories get
+# their own bars, the rest are grouped as "Other" (None keeps every category).
+HISTOGRAM_BINS = 30
+HISTOGRAM_TOP_N = 10
+
+
+def binned_histogram(histogram, x, color, title):
+    """
+    Stacked histogram from the (edges, counts per category) hrdb.sales_histogram() returns.
+
+    Sends one compact bar trace per category (bin centres and counts) rather than
+    px.histogram's trace per category carrying every raw value.
+    """
+    edges, counts = histogram
+    centers = (edges[:-1] + edges[1:]) / 2
+    widths = np.diff(edges)
+    colors = px.colors.qualitative.Set1
+
+    fig = go.Figure()
+    for i, (category, category_counts) in enumerate(counts.items()):
+        fig.add_trace(go.Bar(x=centers, y=category_counts, width=widths, name=category, marker_color=colors[i % len(colors)]))
+
+    fig.update_layout(
+        title=title,
+        template='plotly_white',
+        barmode='stack',
+        bargap=0,
+        xaxis_title=x,
+        yaxis_title='count',
+        legend_title_text=color
+    )
+    return fig
+
+
+# Function to create the layout. It is built per request when the page is opened,
+# only the filter options are read here and the figures are filled by the callback.
+def create_layout():
+    min_date, max_date, regions = hrdb.sales_filter_options()
+
+    layout = html.Div(
+        [
+            dbc.Row(
+                [
+                    dbc.Col(
+                        html.Div([
+                            html.H4("Filter by Time Frame", className='text-center'),
+                            dcc.DatePickerRange(
+                                id='date-picker-range',
+                                start_date=min_date,
+                                end_date=max_date,
+                                display_format='YYYY-MM-DD',
+                                style={"marginBottom": "10px", "textAlign": "center"}
+                            ),
+                        ], style={"textAlign": "center"}),
+                        width=6,
+                    ),
+                    dbc.Col(
+                        html.Div([
+                            html.H4("Filter by Region", className='text-center'),
+                            dcc.Checklist(
+                                id='region-filter',
+                                options=[{'label': region, 'value': region} for region in regions],
+                                value=regions,
+                                inline=True,
+                                labelStyle={"margin": "10px"},
+                                style={"textAlign": "center"}
+                            )
+                        ], style={"textAlign": "center"}),
+                        width=6,
+                    ),
+                ],
+                className="mb-4",
+                style={"height": "15vh"}
+            ),
+            dbc.Row(
+                [
+                    dbc.Col(
+                        dbc.Card(
+                            dbc.CardBody(
+                                [
+                                    html.H5("Total Sales", className="card-title text-center", style={"fontSize": "20px"}),
+                                    html.P(id="total-sales-card", className="card-text text-center", style={"fontSize": "6rem", "color": "#D22630"}),
+                                ]
+                            ),
+                        ),
+                        width=3,
+                    ),
+                    dbc.Col(
+                        dbc.Card(
+                            dbc.CardBody(
+                                [
+                                    html.H5("Total Customers", className="card-title text-center", style={"fontSize": "20px"}),
+                                    html.P(id="total-customers-card", className="card-text text-center", style={"fontSize": "6rem", "color": "#D22630"}),
+                                ],
+
+                            ),
+                        ),
+                        width=3,
+                    ),
+                    dbc.Col(
+                        dbc.Card(
+                            dbc.CardBody(
+                                [
+                                    html.H5("Total Products Sold", className="card-title text-center", style={"fontSize": "20px"}),
+                                    html.P(id="total-products-sold-card", className="card-text text-center", style={"fontSize": "6rem", "color": "#D22630"}),
+                                ]
+                            ),
+                        ),
+                        width=3,
+                    ),
+                    dbc.Col(
+                        dbc.Card(
+                            dbc.CardBody(
+                                [
+                                    html.H5("Average Order Value", className="card-title text-center", style={"fontSize": "20px"}),
+                                    html.P(id="average-order-value-card", className="card-text text-center", style={"fontSize": "6rem", "color": "#D22630"}),
+                                ]
+                            ),
+                        ),
+                        width=3,
+                    ),
+                ],
+                className="mb-4",
+            ),
+            dbc.Row(
+                dbc.Col(html.H2("Overview", className='text-center', style={"paddingTop": "20px"}), width=12)
+            ),
+            dbc.Row(
+                [
+                    dbc.Col(
+                        dcc.Graph(id='sales-over-time-graph'),
+                        width=12
+                    ),
+                ],
+                className="mb-4",
+            ),
+            dbc.Row(
+                [
+                    dbc.Col(
+                        dcc.Graph(id='customer-histogram'),
+                        width=6
+                    ),
+                    dbc.Col(
+                        dcc.Graph(id='product-histogram'),
+                        width=6
+                    ),
+                ],
+                style={"height": "40vh"}
+            ),
+        ],
+        style={"height": "100vh", "padding": "10px"}
+    )
+    return layout
+
+@app.callback(
+    [Output('customer-histogram', 'figure'),
+     Output('product-histogram', 'figure'),
+     Output('sales-over-time-graph', 'figure'),
+     Output('total-sales-card', 'children'),
+     Output('total-customers-card', 'children'),
+     Output('total-products-sold-card', 'children'),
+     Output('average-order-value-card', 'children')],
+    [Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date'),
+     Input('region-filter', 'value')]
+)
+@figure_cache.cached_callback(version=hrdb.database_version)
+def update_graphs_and_cards(start_date, end_date, selected_regions):
+    # Check if the dates are properly parsed
+    if not start_date or not end_date:
+        return {}, {}, {}, "", "", "", ""
+
+    # Filtering and aggregation happen in SQL, only the results are loaded
+    summary = hrdb.sales_summary(start_date, end_date, selected_regions)
+
+    if summary['transactions'] == 0:
+        return {}, {}, {}, "", "", "", ""
+
+    total_sales = summary['total_sales']
+    total_customers = summary['total_customers']
+    total_products_sold = summary['total_products_sold']
+    average_order_value = summary['average_order_value']
+
+    customer_counts = hrdb.sales_histogram('CustomerID', start_date, end_date, selected_regions, bins=HISTOGRAM_BINS, top_n=HISTOGRAM_TOP_N)
+    customer_histogram = binned_histogram(customer_counts, 'TotalAmount', 'CustomerID', 'Sales Distribution by Customer')
+
+    product_counts = hrdb.sales_histogram('ProductID', start_date, end_date, selected_regions, bins=HISTOGRAM_BINS, top_n=HISTOGRAM_TOP_N)
+    product_histogram = binned_histogram(product_counts, 'TotalAmount', 'ProductID', 'Sales Distribution by Product')
+
+    sales_over_time = hrdb.daily_sales(start_date, end_date, selected_regions)
+    fig_sales_over_time = px.line(sales_over_time, x='Date', y='TotalAmount', title='Sales Over Time', template='plotly_white', color_discrete_sequence=[rio_tinto_colors['line']])
+
+    return (
+        customer_histogram, 
+        product_histogram, 
+        fig_sales_over_time, 
+        html.P(f"${total_sales:,.2f}", className="card-text text-center", style={"fontSize": "24px"}), 
+        html.P(total_customers, className="card-text text-center", style={"fontSize": "24px"}), 
+        html.P(total_products_sold, className="card-text text-center", style={"fontSize": "24px"}), 
+        html.P(f"${average_order_value:,.2f}", className="card-text text-center", style={"fontSize": "24px"})
+    )
@@ -1,140 +1,141 @@
-# -*- coding: utf-8 -*-
-"""
-Created on Sat Jul  6 07:41:39 2024
-
-@author: Joseph.Behan
-
-Qyuick analysis of the top customers up to 20.
-
-"""
-import dash_bootstrap_components as dbc
-from dash import dcc, html
-import plotly.express as px
-import plotly.graph_objects as go
-import sqlite3
-import pandas as pd
-from dash.dependencies import Input, Output
-from server import app, rio_tinto_colors
-import pySQL_library as hrdb
-
-# Function to create the layout
-def create_layout():
-    sales_df, customers_df = hrdb.get_data()
-    top_customers = sales_df.groupby('CustomerID').sum(numeric_only=True)['TotalAmount'].reset_index()
-    top_customers = top_customers.nlargest(10, 'TotalAmount').merge(customers_df, on='CustomerID')
-
-    fig_top_customers = px.bar(
-        top_customers,
-        x='CustomerID',
-        y='TotalAmount',
-        title='Top 10 Customers by Sales',
-        template='plotly_white',
-        color_discrete_sequence=['#005792']
-    )
-
-    layout = dbc.Container(
-        [
-            dbc.Row(
-                dbc.Col(html.H2("", className='text-center'), width=12)
-            ),
-            dbc.Row(
-                dbc.Col(
-                    html.Div([
-                        html.Label('Select Number of Top Customers', style={'marginBottom': '10px'}),
-                        dcc.Slider(
-                            id='customer-slider',
-                            min=1,
-                            max=20,
-                            step=1,
-                            value=10,
-                            marks={i: str(i) for i in range(1, 21)},
-                            className='mb-4'
-                        )
-                    ], style={'marginTop': '20px'}),
-                    width=12
-                )
-            ),
-            dbc.Row(
-                [
-                    dbc.Col(dcc.Graph(id='top-customers-graph', figure=fig_top_customers), width=6),
-                    dbc.Col(dcc.Graph(id='sales-percentage-graph'), width=6),
-                ]
-            ),
-            dbc.Row(
-                dbc.Col(dcc.Graph(id='clv-bubble-chart', style={"height": "50vh"}), width=12)
-            ),
-        ],
-        fluid=True,
-    )
-    return layout
-
-# Register the layout function as the page layout
-layout = create_layout()
-
-@app.callback(
-    [Output('top-customers-graph', 'figure'),
-     Output('sales-percentage-graph', 'figure'),
-     Output('clv-bubble-chart', 'figure')],
-    [Input('customer-slider', 'value')]
-)
-def update_top_customers(num_customers):
-    sales_df, customers_df = hrdb.get_data()
-    
-    top_customers = sales_df.groupby('CustomerID').sum(numeric_only=True)['TotalAmount'].reset_index()
-    top_customers = top_customers.nlargest(num_customers, 'TotalAmount').merge(customers_df, on='CustomerID')
-
-    fig_top_customers = px.bar(
-        top_customers,
-        x='CustomerID',
-        y='TotalAmount',
-        title=f'Top {num_customers} Customers by Sales',
-        template='plotly_white',
-        color_discrete_sequence=['#005792']
-    )
-
-    total_sales = sales_df['TotalAmount'].sum()
-    percentage_sales = top_customers['TotalAmount'].sum() / total_sales * 100
-    remaining_sales = total_sales - top_customers['TotalAmount'].sum()
-    
-    fig_sales_percentage = go.Figure(go.Pie(
-        labels=[f'Top {num_customers} Customers', 'Others'],
-        values=[percentage_sales, 100 - percentage_sales],
-        marker=dict(colors=['#005792', '#E5E5E5'])
-    ))
-    fig_sales_percentage.update_layout(title='Sales Percentage by Top Customers')
-
-    clv_summary = sales_df.groupby('CustomerID').agg(
-        AverageOrderValue=pd.NamedAgg(column='TotalAmount', aggfunc='mean'),
-        PurchaseFrequency=pd.NamedAgg(column='TransactionID', aggfunc='count')
-    ).reset_index()
-
-    average_lifespan = 3
-    clv_summary['PurchaseFrequency'] = clv_summary['PurchaseFrequency'] / len(sales_df['Date'].dt.year.unique())
-    clv_summary['CLV'] = clv_summary['AverageOrderValue'] * clv_summary['PurchaseFrequency'] * average_lifespan
-
-    fig_clv_bubble = px.scatter(
-        clv_summary,
-        x='AverageOrderValue',
-        y='PurchaseFrequency',
-        size='CLV',
-        color='CLV',
-        hover_data=['CustomerID'],
-        title='Customer Lifetime Value (CLV) = (Ave Order Value * Purchase Frequency * Average Lifespan)',
-        template='plotly_white',
-        color_continuous_scale='Viridis',
-        height=700  # Increase the height of the plot
-    )
-
-    # Add threshold line
-    fig_clv_bubble.add_shape(
-        type='line',
-        x0=clv_summary['AverageOrderValue'].min(),
-        y0=750 / clv_summary['AverageOrderValue'].min() / average_lifespan,
-        x1=clv_summary['AverageOrderValue'].max(),
-        y1=500 / clv_summary['AverageOrderValue'].max() / average_lifespan,
-        line=dict(color='red', dash='dash')
-    )
-
-    fig_clv_bubble.update_layout(coloraxis_colorbar=dict(title='CLV'))
-
-    return fig_top_customers, fig_sales_percentage, fig_clv_bubble
\ No newline at end of file
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Jul  6 07:41:39 2024
+
+@author: Joseph.Behan
+
+Qyuick analysis of the top customers up to 20.
+
+"""
+import dash_bootstrap_components as dbc
+from dash import dcc, html
+import plotly.express as px
+import plotly.graph_objects as go
+import sqlite3
+import pandas as pd
+from dash.dependencies import Input, Output
+from server import app, rio_tinto_colors
+import pySQL_library as hrdb
+import figure_cache
+
+# Function to create the layout, built when the page is opened. The figures are filled by the callback.
+def create_layout():
+    layout = dbc.Container(
+        [
+            dbc.Row(
+                dbc.Col(html.H2("", className='text-center'), width=12)
+            ),
+            dbc.Row(
+                dbc.Col(
+                    html.Div([
+                        html.Label('Select Number of Top Customers', style={'marginBottom': '10px'}),
+                        dcc.Slider(
+                            id='customer-slider',
+                            min=1,
+                            max=20,
+                            step=1,
+                            value=10,
+                            marks={i: str(i) for i in range(1, 21)},
+                            className='mb-4'
+                        )
+                    ], style={'marginTop': '20px'}),
+                    width=12
+                )
+            ),
+            dbc.Row(
+                [
+                    dbc.Col(dcc.Graph(id='top-customers-graph'), width=6),
+                    dbc.Col(dcc.Graph(id='sales-percentage-graph'), width=6),
+                ]
+            ),
+            dbc.Row(
+                dbc.Col(dcc.Graph(id='clv-bubble-chart', style={"height": "50vh"}), width=12)
+            ),
+        ],
+        fluid=True,
+    )
+    return layout
+
+@hrdb.cached_per_data_version
+def customer_summaries():
+    """
+    Everything on the page that does not depend on the slider, computed once per
+    data version: customers ranked by sales, total sales and the finished CLV chart.
+    """
+    sales_df, customers_df = hrdb.get_data()
+
+    # Customers pre-sorted by sales, so the slider only takes the first N rows
+    customer_ranking = hrdb.sales_ranking(sales_df, 'CustomerID')
+
+    total_sales = sales_df['TotalAmount'].astype('float64').sum()
+
+    clv_summary = sales_df.groupby('CustomerID').agg(
+        AverageOrderValue=pd.NamedAgg(column='TotalAmount', aggfunc='mean'),
+        PurchaseFrequency=pd.NamedAgg(column='TransactionID', aggfunc='count')
+    ).reset_index()
+
+    average_lifespan = 3
+    clv_summary['PurchaseFrequency'] = clv_summary['PurchaseFrequency'] / len(sales_df['Date'].dt.year.unique())
+    clv_summary['CLV'] = clv_summary['AverageOrderValue'] * clv_summary['PurchaseFrequency'] * average_lifespan
+
+    fig_clv_bubble = px.scatter(
+        clv_summary,
+        x='AverageOrderValue',
+        y='PurchaseFrequency',
+        size='CLV',
+        color='CLV',
+        hover_data=['CustomerID'],
+        title='Customer Lifetime Value (CLV) = (Ave Order Value * Purchase Frequency * Average Lifespan)',
+        template='plotly_white',
+        color_continuous_scale='Viridis',
+        height=700  # Increase the height of the plot
+    )
+
+    # Add threshold line
+    fig_clv_bubble.add_shape(
+        type='line',
+        x0=clv_summary['AverageOrderValue'].min(),
+        y0=750 / clv_summary['AverageOrderValue'].min() / average_lifespan,
+        x1=clv_summary['AverageOrderValue'].max(),
+        y1=500 / clv_summary['AverageOrderValue'].max() / average_lifespan,
+        line=dict(color='red', dash='dash')
+    )
+
+    fig_clv_bubble.update_layout(coloraxis_colorbar=dict(title='CLV'))
+
+    return customer_ranking, customers_df, total_sales, fig_clv_bubble
+
+
+@app.callback(
+    [Output('top-customers-graph', 'figure'),
+     Output('sales-percentage-graph', 'figure'),
+     Output('clv-bubble-chart', 'figure')],
+    [Input('customer-slider', 'value')]
+)
+@figure_cache.cached_callback()
+def update_top_customers(num_customers):
+    customer_ranking, customers_df, total_sales, fig_clv_bubble = customer_summaries()
+    
+    top_customers, top_sales = hrdb.top_of_ranking(customer_ranking, num_customers)
+    top_customers = top_customers.merge(customers_df, on='CustomerID')
+
+    fig_top_customers = px.bar(
+        top_customers,
+        x='CustomerID',
+        y='TotalAmount',
+        title=f'Top {num_customers} Customers by Sales',
+        template='plotly_white',
+        color_discrete_sequence=['#005792']
+    )
+
+    percentage_sales = top_sales / total_sales * 100
+    remaining_sales = total_sales - top_sales
+    
+    fig_sales_percentage = go.Figure(go.Pie(
+        labels=[f'Top {num_customers} Customers', 'Others'],
+        values=[percentage_sales, 100 - percentage_sales],
+        marker=dict(colors=['#005792', '#E5E5E5'])
+    ))
+    fig_sales_percentage.update_layout(title='Sales Percentage by Top Customers')
+
+    return fig_top_customers, fig_sales_percentage, fig_clv_bubble
@@ -1,263 +1,1263 @@
-# -*- coding: utf-8 -*-
-"""
-Created on Fri Jul  5 14:16:15 2024
-
-@author: Joseph.Behan
-"""
-
-import csv
-import sqlite3
-import glob
-import os
-import pandas as pd
-from datetime import datetime, timedelta
-import time
-
-
-
-
-###############################################################################
-
-#################### Create the tables within the database ####################
-
-###############################################################################
-def create_customerdetails_table(filename, db):
-    """Create the customerdetails table in the database from a CSV file."""
-    print(f"Creating customerdetails table from {filename}...")
-    with open(filename, newline='') as f:
-        reader = csv.DictReader(f)
-        table_name = 'customerdetails'
-        
-        # Drop table if it exists
-        db.execute(f'DROP TABLE IF EXISTS "{table_name}"')
-        
-        # Create table with all required columns
-        db.execute(f'''
-            CREATE TABLE "{table_name}" (
-                "CustomerID" INTEGER PRIMARY KEY,
-                "CustomerName" TEXT,
-                "City" TEXT,
-                "State" TEXT,
-                "Postcode" TEXT
-            )
-        ''')
-        
-        # Insert data
-        insert_sql = f'''
-            INSERT INTO "{table_name}" 
-            ("CustomerID", "CustomerName", "City", "State", "Postcode") 
-            VALUES (?, ?, ?, ?, ?)
-        '''
-        data = [(int(row['CustomerID']), row['CustomerName'], row['City'], row['State'], row['Postcode']) 
-                for row in reader if row['CustomerID'].isdigit()]
-        db.executemany(insert_sql, data)
-    print(f"customerdetails table created with {len(data)} records.")
-
-
-
-def create_salesdetails_table(filename, db):
-    """Create the salesdetails table in the database from a CSV file."""
-    print(f"Creating salesdetails table from {filename}...")
-    with open(filename, newline='') as f:
-        reader = csv.DictReader(f)
-        columns = reader.fieldnames
-        table_name = 'salesdetails'
-
-        # Drop table if it exists
-        db.execute(f'DROP TABLE IF EXISTS "{table_name}"')
-
-        # Define columns with appropriate data types
-        columns_with_types = []
-        for col in columns:
-            if col == 'CustomerID':
-                continue  # Skip CustomerID
-            if col in ['TransactionID', 'ProductID', 'StoreID', 'SalespersonID']:
-                columns_with_types.append(f'"{col}" INTEGER')
-            elif col == 'Date':
-                columns_with_types.append(f'"{col}" DATE')
-            elif col == 'Quantity':
-                columns_with_types.append(f'"{col}" INTEGER')
-            elif col in ['Price', 'Discount', 'TotalAmount']:
-                columns_with_types.append(f'"{col}" REAL')
-            else:
-                columns_with_types.append(f'"{col}" TEXT')
-
-        columns_with_types.append('"CustomerID" INTEGER')  # Add CustomerID as foreign key
-        columns_with_types_str = ', '.join(columns_with_types)
-        db.execute(f'CREATE TABLE "{table_name}" ({columns_with_types_str}, FOREIGN KEY ("CustomerID") REFERENCES "customerdetails"("CustomerID"))')
-
-        # Insert data
-        placeholders = ', '.join('?' for _ in columns)
-        insert_sql = f'INSERT INTO "{table_name}" ({", ".join(columns)}) VALUES ({placeholders})'
-        db.executemany(insert_sql, (tuple(int(row[col]) if col == 'CustomerID' and row[col].isdigit() else row[col] for col in columns) for row in reader))
-    print(f"salesdetails table created with {len(columns)} columns.")
-
-# Step 2: Data Transformation
-def transform_data(db):
-    
-    """
-    Transform data by calculating TotalAmount as Quantity * Price - Discount, but only for new records.
-    
-    """
-    update_total_amount = '''
-                            UPDATE salesdetails
-                            SET TotalAmount = (Quantity * Price) - Discount
-                            WHERE TotalAmount IS NULL OR TotalAmount = 0 OR TotalAmount = (Quantity * Price)
-                            '''
-    db.execute(update_total_amount)
-
-
-# Step 3: Data Loading
-def connect_to_database(db_name):
-    return sqlite3.connect(db_name)
-
-def query_database(query): 
-    conn = connect_to_database('data/sales_transactions.db')
-    df = pd.read_sql(query, conn)
-    conn.close()
-    return df
-
-
-# Step 3b: Combining the queries
-
-def get_data():
-    # Connect to the SQLite database
-    conn = sqlite3.connect('data/sales_transactions.db')
-    sales_df = pd.read_sql_query("SELECT * FROM salesdetails", conn)
-    customers_df = pd.read_sql_query("SELECT * FROM customerdetails", conn)
-    conn.close()
-    # Convert 'Date' column to datetime
-    sales_df['Date'] = pd.to_datetime(sales_df['Date'])
-    return sales_df, customers_df
-
-###############################################################################
-
-#################### Update the database using the below f ####################
-
-###############################################################################
-
-def update_database_from_csv(db, customer_csv, sales_csv, max_retries=5):
-    """Update the database with new rows from the CSV files."""
-    for attempt in range(max_retries):
-        try:
-            # Update customer details
-            with open(customer_csv, newline='') as f:
-                reader = csv.DictReader(f)
-                customers = {row['CustomerID'] for row in reader}  # Use a set to ensure uniqueness
-
-            existing_customers = {str(row[0]) for row in db.execute('SELECT CustomerID FROM customerdetails')}
-            new_customers = customers - existing_customers
-
-            if new_customers:
-                insert_sql = 'INSERT OR IGNORE INTO customerdetails (CustomerID) VALUES (?)'
-                db.executemany(insert_sql, [(customer,) for customer in new_customers])
-                print(f"Inserted {len(new_customers)} new customers into customerdetails table.")
-            else:
-                print("No new customers to insert.")
-
-            # Update sales details
-            with open(sales_csv, newline='') as f:
-                reader = csv.DictReader(f)
-                sales = [tuple(row[col] for col in reader.fieldnames) for row in reader]
-                sales_fieldnames = reader.fieldnames
-
-            existing_sales = {str(row[0]) for row in db.execute('SELECT TransactionID FROM salesdetails')}
-            new_sales = [row for row in sales if str(row[sales_fieldnames.index('TransactionID')]) not in existing_sales]
-
-            if new_sales:
-                columns = ', '.join(sales_fieldnames)
-                placeholders = ', '.join('?' for _ in sales_fieldnames)
-                insert_sql = f'INSERT INTO salesdetails ({columns}) VALUES ({placeholders})'
-                db.executemany(insert_sql, new_sales)
-                print(f"Inserted {len(new_sales)} new transactions into salesdetails table.")
-            else:
-                print("No new sales transactions to insert.")
-
-            break  # If successful, exit the retry loop
-        except sqlite3.OperationalError as e:
-            if 'database is locked' in str(e):
-                print(f"Attempt {attempt + 1} of {max_retries} failed: database is locked. Retrying in 1 second...")
-                time.sleep(1)  # Wait before retrying
-            else:
-                raise
-    else:
-        print("Failed to update the database after multiple attempts due to database being locked.")
-
-
-def print_table_contents(db, table_name):
-    """Print the contents of a table."""
-    print(f"Contents of {table_name} table:")
-    cursor = db.execute(f'SELECT * FROM "{table_name}"')
-    rows = cursor.fetchall()
-    for row in rows:
-        print(row)
-    if not rows:
-        print("No data found.")
-    print()
-
-###############################################################################
-
-#################### Illustrate the required queries below ####################
-
-###############################################################################
-
-
-def extract_sales_last_quarter():
-    start_of_last_quarter = '2023-10-01'
-    end_of_last_quarter = '2023-12-31'
-    query = f"""
-    SELECT * FROM salesdetails
-    WHERE Date >= '{start_of_last_quarter}' AND Date <= '{end_of_last_quarter}'
-    """
-    return query_database(query)
-
-
-
-def calculate_total_sales_per_region():
-    query = """
-    SELECT Region, SUM(TotalAmount) as total_sales
-    FROM salesdetails
-    GROUP BY Region
-    """
-    return query_database(query)
-
-
-# Join the sales data with a customer details table to find the total sales amount per customer
-def total_sales_per_customer():
-    query = """
-    SELECT c.CustomerID, SUM(s.TotalAmount) as total_sales
-    FROM salesdetails s
-    JOIN customerdetails c ON s.CustomerID = c.CustomerID
-    GROUP BY c.CustomerID
-    """
-    return query_database(query)
-
-
-# Retrieve the top 10 products by sales amount in the last month (December 2023)
-def top_10_products_last_month():
-    start_of_last_month = '2023-12-01'
-    end_of_last_month = '2023-12-31'
-    query = f"""
-    SELECT ProductID, SUM(TotalAmount) as total_sales
-    FROM salesdetails
-    WHERE Date >= '{start_of_last_month}' AND Date <= '{end_of_last_month}'
-    GROUP BY ProductID
-    ORDER BY total_sales DESC
-    LIMIT 10
-    """
-    return query_database(query)
-
-
-# Identify customers who have not made a purchase in the last six months (from 01/07/2023 to 31/12/2023)
-def customers_no_purchase_last_six_months():
-    six_months_ago = '2023-07-01'
-    end_date = '2023-12-31'
-    query = f"""
-    SELECT * FROM customerdetails
-    WHERE CustomerID NOT IN (
-        SELECT DISTINCT CustomerID
-        FROM salesdetails
-        WHERE Date >= '{six_months_ago}' AND Date <= '{end_date}'
-    )
-    """
-    return query_database(query)
\ No newline at end of file
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Jul  5 14:16:15 2024
+
+@author: Joseph.Behan
+"""
+
+import csv
+import sqlite3
+import glob
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+import time
+import threading
+import itertools
+import hashlib
+import functools
+import json
+from contextlib import contextmanager
+import db_pool
+import metrics
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # The columnar snapshot is optional, get_data() then reads through SQL
+    feather = None
+
+
+# The CSV exports store dates as d/mm/yyyy, which SQLite cannot range-compare.
+# This expression normalises them (and ISO dates) to YYYY-MM-DD.
+SQL_ISO_DATE = """
+    CASE WHEN instr(Date, '/') > 0
+        THEN printf('%04d-%02d-%02d', CAST(substr(Date, -4) AS INTEGER),
+                    CAST(substr(Date, instr(Date, '/') + 1) AS INTEGER), CAST(Date AS INTEGER))
+        ELSE substr(Date, 1, 10)
+    END"""
+
+
+# Rows are read from the CSVs and inserted this many at a time, so peak memory
+# stays flat no matter how large the export is.
+INGEST_BATCH_SIZE = 10000
+
+
+def iter_batches(rows, batch_size=INGEST_BATCH_SIZE):
+    """Yield lists of at most batch_size rows from any iterable, without reading ahead."""
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+@contextmanager
+def bulk_load(db):
+    """
+    Relax durability for the duration of a bulk load. The data can always be
+    reloaded from the CSVs, so a crash mid-load only costs a rerun.
+    """
+    if db.in_transaction:
+        db.commit()  # journal_mode and synchronous cannot change inside a transaction
+    synchronous = db.execute('PRAGMA synchronous').fetchone()[0]
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=OFF')
+    try:
+        yield db
+    finally:
+        if db.in_transaction:
+            db.commit()
+        db.execute(f'PRAGMA synchronous={synchronous}')
+
+
+def insert_batches(db, insert_sql, rows, batch_size=INGEST_BATCH_SIZE):
+    """Insert rows batch by batch, one transaction per batch. Returns the number of rows written."""
+    inserted = 0
+    with bulk_load(db):
+        for batch in iter_batches(rows, batch_size):
+            changes = db.total_changes
+            db.executemany(insert_sql, batch)
+            db.commit()
+            inserted += db.total_changes - changes
+    return inserted
+
+
+class _RowCounter:
+    """Iterates over rows, counting them as they go by."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
+
+
+def _record_ingest(stats, table_name, read, inserted):
+    # stats is the optional dict the ingest functions report into
+    if stats is not None:
+        stats[table_name] = {'read': read, 'inserted': inserted, 'skipped': read - inserted}
+
+
+def _replace_table(db, table_name, create_sql):
+    """
+    Create an empty staging copy of a table. _swap_table() later puts it in place
+    of the live table in one step, so readers never see a half-loaded table.
+    """
+    staging = f'{table_name}_staging'
+    db.execute(f'DROP TABLE IF EXISTS "{staging}"')
+    db.execute(create_sql.format(table=staging))
+    return staging
+
+
+def _swap_table(db, table_name, staging):
+    if db.in_transaction:
+        db.commit()
+    db.execute('BEGIN')
+    db.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+    db.execute(f'ALTER TABLE "{staging}" RENAME TO "{table_name}"')
+    db.commit()
+
+
+# Each CSV source has a watermark: the byte offset ingested so far plus a hash
+# of every byte before it. A refresh resumes from the offset while the hash still
+# matches, that is while the file has only been appended to. Any other change
+# means the tables are reloaded from the CSVs in full.
+HASH_BLOCK_BYTES = 1024 * 1024
+
+
+class SourceChanged(Exception):
+    """The already ingested part of a CSV source was rewritten, so it cannot be resumed."""
+
+
+def ensure_watermark_table(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS "etl_watermarks" (
+            "Source" TEXT PRIMARY KEY,
+            "ByteOffset" INTEGER,
+            "Fingerprint" TEXT,
+            "UpdatedAt" TEXT
+        )
+    ''')
+
+
+def get_watermark(db, source):
+    """Return (byte_offset, fingerprint) for a CSV source, or None if it has not been ingested."""
+    ensure_watermark_table(db)
+    return db.execute('SELECT ByteOffset, Fingerprint FROM etl_watermarks WHERE Source = ?', (source,)).fetchone()
+
+
+def save_watermark(db, source, byte_offset, fingerprint):
+    ensure_watermark_table(db)
+    db.execute(
+        'INSERT OR REPLACE INTO etl_watermarks (Source, ByteOffset, Fingerprint, UpdatedAt) VALUES (?, ?, ?, ?)',
+        (source, byte_offset, fingerprint, datetime.now().isoformat(timespec='seconds'))
+    )
+
+
+def reset_watermark(db, source):
+    ensure_watermark_table(db)
+    db.execute('DELETE FROM etl_watermarks WHERE Source = ?', (source,))
+
+
+# How far transform_data() and update_rollups() have got through salesdetails, as
+# the highest rowid each has processed. It is saved in the same transaction as the
+# work, so rows committed by a refresh that failed afterwards are picked up by the next.
+def ensure_progress_table(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS "etl_progress" (
+            "Stage" TEXT PRIMARY KEY,
+            "ThroughRowid" INTEGER
+        )
+    ''')
+
+
+def get_progress(db, stage):
+    """Highest salesdetails rowid the stage has processed, or None if it has no record."""
+    ensure_progress_table(db)
+    row = db.execute('SELECT ThroughRowid FROM etl_progress WHERE Stage = ?', (stage,)).fetchone()
+    return row[0] if row is not None else None
+
+
+def save_progress(db, stage, rowid):
+    ensure_progress_table(db)
+    db.execute('INSERT OR REPLACE INTO etl_progress (Stage, ThroughRowid) VALUES (?, ?)', (stage, rowid))
+
+
+def reset_progress(db):
+    ensure_progress_table(db)
+    db.execute('DELETE FROM etl_progress')
+
+
+def _max_sales_rowid(db):
+    return db.execute('SELECT COALESCE(MAX(rowid), 0) FROM salesdetails').fetchone()[0]
+
+
+def _hash_range(f, digest, start, end):
+    """Add the bytes from start to end of the file to digest."""
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        block = f.read(min(HASH_BLOCK_BYTES, remaining))
+        if not block:
+            break
+        digest.update(block)
+        remaining -= len(block)
+
+
+def _last_line_end(f, minimum):
+    """Offset just past the last complete line of the file."""
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    while position > minimum:
+        block = min(HASH_BLOCK_BYTES, position - minimum)
+        f.seek(position - block)
+        newline = f.read(block).rfind(b'\n')
+        if newline >= 0:
+            return position - block + newline + 1
+        position -= block
+    return minimum
+
+
+def _csv_lines(f, start, end, field_count):
+    f.seek(start)
+    while f.tell() < end:
+        line = f.readline()
+        if not line:
+            break
+        line = line.decode('utf-8')
+        if not line.endswith('\n') and len(next(csv.reader([line]), [])) < field_count:
+            break  # A truncated final row that is still being written
+        yield line
+
+
+@contextmanager
+def open_csv_increment(db, path):
+    """
+    Open the part of a CSV file that has not been ingested yet.
+
+    Yields (reader, incremental). reader is a csv.DictReader over the rows after the
+    watermark (incremental=True), or over the whole file when it has none yet.
+    Raises SourceChanged when the part before the watermark is no longer what was
+    ingested. The watermark is moved forward when the block exits without an error.
+    """
+    with open(path, 'rb') as f:
+        header = f.readline()
+        size = f.seek(0, os.SEEK_END)
+        # A final line without a newline is read now but left after the watermark,
+        # so it is read again (and de-duplicated) if it was still being written.
+        end = _last_line_end(f, len(header))
+
+        start = len(header)
+        incremental = False
+        # One pass: the hash of the ingested prefix is checked, then carried on to the end
+        digest = hashlib.sha1()
+        watermark = get_watermark(db, path)
+        if watermark is not None:
+            offset, fingerprint = watermark
+            if not len(header) <= offset <= end:
+                raise SourceChanged(path)
+            _hash_range(f, digest, 0, offset)
+            if f"{offset}:{digest.hexdigest()}" != fingerprint:
+                raise SourceChanged(path)
+            start = offset
+            incremental = True
+            print(f"Resuming {path} from byte {offset} of {size}.")
+
+        _hash_range(f, digest, start if incremental else 0, end)
+        new_fingerprint = f"{end}:{digest.hexdigest()}"
+        fieldnames = next(csv.reader([header.decode('utf-8-sig')]))
+        yield csv.DictReader(_csv_lines(f, start, size, len(fieldnames)), fieldnames=fieldnames), incremental
+
+    save_watermark(db, path, end, new_fingerprint)
+
+
+###############################################################################
+
+#################### Create the tables within the database ####################
+
+###############################################################################
+def create_customerdetails_table(filename, db, stats=None):
+    """
+    Create the customerdetails table in the database from a CSV file.
+    Rows read, inserted and skipped are recorded in stats when a dict is given.
+    """
+    print(f"Creating customerdetails table from {filename}...")
+    reset_watermark(db, filename)
+    with open_csv_increment(db, filename) as (reader, _):
+        reader = _RowCounter(reader)
+        table_name = 'customerdetails'
+        
+        # Create table with all required columns, loaded alongside the live table
+        staging = _replace_table(db, table_name, '''
+            CREATE TABLE "{table}" (
+                "CustomerID" INTEGER PRIMARY KEY,
+                "CustomerName" TEXT,
+                "City" TEXT,
+                "State" TEXT,
+                "Postcode" TEXT
+            )
+        ''')
+        
+        # Insert data
+        insert_sql = f'''
+            INSERT INTO "{staging}" 
+            ("CustomerID", "CustomerName", "City", "State", "Postcode") 
+            VALUES (?, ?, ?, ?, ?)
+        '''
+        data = ((int(row['CustomerID']), row['CustomerName'], row['City'], row['State'], row['Postcode']) 
+                for row in reader if row['CustomerID'].isdigit())
+        count = insert_batches(db, insert_sql, data)
+        _swap_table(db, table_name, staging)
+    _record_ingest(stats, table_name, reader.count, count)
+    print(f"customerdetails table created with {count} records.")
+
+
+
+def to_iso_date(value):
+    """Convert a d/mm/yyyy CSV date to YYYY-MM-DD so it sorts and range-compares as text."""
+    if '/' in value:
+        day, month, year = value.split('/')
+        return f"{int(year):04d}-{int(month):02d}-{int(day):02d}"
+    return value[:10]
+
+
+# Indexes on salesdetails. The trailing columns make them covering for the
+# library queries and dashboard aggregates, so those never touch the table rows.
+SALESDETAILS_INDEXES = {
+    'idx_salesdetails_date': ['Date', 'ProductID', 'TotalAmount'],
+    'idx_salesdetails_date_customer': ['Date', 'CustomerID'],
+    'idx_salesdetails_customer': ['CustomerID', 'TotalAmount'],
+    'idx_salesdetails_product': ['ProductID', 'TotalAmount'],
+    'idx_salesdetails_region': ['Region', 'TotalAmount'],
+    'idx_salesdetails_transaction': ['TransactionID'],
+}
+
+
+def create_salesdetails_indexes(db):
+    """Create any missing salesdetails indexes and refresh the planner statistics."""
+    for name, columns in SALESDETAILS_INDEXES.items():
+        db.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON salesdetails ({", ".join(columns)})')
+    db.execute('ANALYZE salesdetails')
+
+
+# Recorded in PRAGMA user_version once salesdetails has ISO dates and every index
+# in SALESDETAILS_INDEXES, and the rollups have the columns of create_rollup_tables().
+# Bump it when any of them changes, so migrate_salesdetails() brings existing
+# databases up to date again.
+# 2: rollups carry MinTotalAmount and MaxTotalAmount
+SCHEMA_VERSION = 2
+
+
+def _mark_schema_current(db):
+    db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+
+def migrate_salesdetails(db):
+    """
+    Bring a salesdetails table created by an older ETL up to date (ISO dates,
+    indexes, rollups). The date conversion, indexing and rollup rebuild scan the
+    whole table, so they only run while the database's user_version is below
+    SCHEMA_VERSION (or the rollups are missing).
+    """
+    outdated = db.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION
+    if outdated:
+        updated = db.execute(f"UPDATE salesdetails SET Date = {SQL_ISO_DATE} WHERE instr(Date, '/') > 0").rowcount
+        if updated:
+            print(f"Converted {updated} salesdetails dates to YYYY-MM-DD.")
+        create_salesdetails_indexes(db)
+        _mark_schema_current(db)
+
+    existing = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if outdated or not set(ROLLUPS) <= existing:
+        print("Rebuilding the daily rollup tables.")
+        rebuild_rollups(db)
+
+
+@db_pool.on_open
+def upgrade_database(pool):
+    """
+    Run migrate_salesdetails() on the pool's database before the dashboards first
+    read it, so one built by an older ETL gets its rollup tables without waiting for
+    a refresh. Cheap once the database is current. A database without salesdetails
+    yet is left to the ETL to create.
+    """
+    if not os.path.exists(pool.db_path):
+        return
+    with pool.writer() as db:
+        if db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'salesdetails'").fetchone():
+            migrate_salesdetails(db)
+
+
+def create_salesdetails_table(filename, db, stats=None):
+    """
+    Create the salesdetails table in the database from a CSV file.
+    Rows read, inserted and skipped are recorded in stats when a dict is given.
+    """
+    print(f"Creating salesdetails table from {filename}...")
+    reset_watermark(db, filename)
+    with open_csv_increment(db, filename) as (reader, _):
+        columns = reader.fieldnames
+        reader = _RowCounter(reader)
+        table_name = 'salesdetails'
+
+        # Define columns with appropriate data types
+        columns_with_types = []
+        for col in columns:
+            if col == 'CustomerID':
+                continue  # Skip CustomerID
+            if col in ['TransactionID', 'ProductID', 'StoreID', 'SalespersonID']:
+                columns_with_types.append(f'"{col}" INTEGER')
+            elif col == 'Date':
+                columns_with_types.append(f'"{col}" DATE')
+            elif col == 'Quantity':
+                columns_with_types.append(f'"{col}" INTEGER')
+            elif col in ['Price', 'Discount', 'TotalAmount']:
+                columns_with_types.append(f'"{col}" REAL')
+            else:
+                columns_with_types.append(f'"{col}" TEXT')
+
+        columns_with_types.append('"CustomerID" INTEGER')  # Add CustomerID as foreign key
+        columns_with_types_str = ', '.join(columns_with_types)
+        staging = _replace_table(db, table_name, f'CREATE TABLE "{{table}}" ({columns_with_types_str}, FOREIGN KEY ("CustomerID") REFERENCES "customerdetails"("CustomerID"))')
+
+        # Insert data
+        placeholders = ', '.join('?' for _ in columns)
+        insert_sql = f'INSERT INTO "{staging}" ({", ".join(columns)}) VALUES ({placeholders})'
+        count = insert_batches(db, insert_sql, (tuple(int(row[col]) if col == 'CustomerID' and row[col].isdigit() else to_iso_date(row[col]) if col == 'Date' else row[col] for col in columns) for row in reader))
+        # Row ids start over with the new table
+        reset_progress(db)
+        _swap_table(db, table_name, staging)
+    _record_ingest(stats, table_name, reader.count, count)
+
+    # Index after the bulk insert, it is much cheaper than maintaining them row by row
+    create_salesdetails_indexes(db)
+    _mark_schema_current(db)
+    print(f"salesdetails table created with {len(columns)} columns and {count} records.")
+
+def reload_from_csv(db, customer_csv, sales_csv, stats=None):
+    """
+    Load both tables from the CSVs in full, transform them and rebuild the rollups.
+    The tables are loaded into staging copies first, so readers see the old tables
+    until each swap.
+    """
+    create_customerdetails_table(customer_csv, db, stats)
+    create_salesdetails_table(sales_csv, db, stats)
+    transform_data(db)
+    rebuild_rollups(db)
+
+
+# Step 2: Data Transformation
+def transform_data(db, after_rowid=None):
+
+    """
+    Transform data by calculating TotalAmount as Quantity * Price - Discount, but only for new records.
+
+    Only rows with a rowid above after_rowid are touched. By default those are the
+    rows the last transform did not reach (the whole table after a full load), as
+    recorded in etl_progress together with the update.
+
+    """
+    if after_rowid is None:
+        after_rowid = get_progress(db, 'transform') or 0
+    through_rowid = _max_sales_rowid(db)
+    update_total_amount = '''
+                            UPDATE salesdetails
+                            SET TotalAmount = (Quantity * Price) - Discount
+                            WHERE rowid > ? AND rowid <= ?
+                            AND (TotalAmount IS NULL OR TotalAmount = 0 OR TotalAmount = (Quantity * Price))
+                            '''
+    db.execute(update_total_amount, (after_rowid, through_rowid))
+    save_progress(db, 'transform', through_rowid)
+
+
+# Step 2b: Daily rollups
+# Pre-aggregated copies of salesdetails that the dashboards read instead of the
+# raw transactions. Each is keyed by Date plus the listed columns and is updated
+# incrementally with the rows of every ingest.
+ROLLUPS = {
+    'rollup_daily_region': ['Region'],
+    'rollup_daily_customer': ['Region', 'CustomerID'],
+    'rollup_daily_product': ['Region', 'ProductID'],
+    'rollup_daily_state': ['State'],
+}
+
+_ROLLUP_KEY_SOURCE = {'Region': 's.Region', 'CustomerID': 's.CustomerID', 'ProductID': 's.ProductID', 'State': 'c.State'}
+
+
+def create_rollup_tables(db):
+    for table, keys in ROLLUPS.items():
+        key_columns = ', '.join(f'"{key}"' for key in keys)
+        db.execute(f'''
+            CREATE TABLE IF NOT EXISTS "{table}" (
+                "Date" DATE, {', '.join(f'"{key}"' for key in keys)},
+                "TotalAmount" REAL, "Quantity" INTEGER, "Discount" REAL, "Transactions" INTEGER,
+                "MinTotalAmount" REAL, "MaxTotalAmount" REAL,
+                PRIMARY KEY ("Date", {key_columns})
+            ) WITHOUT ROWID
+        ''')
+
+
+def rollup_upsert_sql(table):
+    """The statement adding the salesdetails rows with a rowid in (?, ?] to a rollup table."""
+    keys = ROLLUPS[table]
+    key_columns = ', '.join(keys)
+    source_columns = ', '.join(_ROLLUP_KEY_SOURCE[key] for key in keys)
+    # State comes from customerdetails, sales without a known customer are left out
+    join = 'JOIN customerdetails c ON c.CustomerID = s.CustomerID' if 'State' in keys else ''
+    # NOT INDEXED: otherwise SQLite walks a whole covering index in GROUP BY order
+    # instead of searching the rowid range, and every refresh scans the table
+    return f'''
+        INSERT INTO "{table}" (Date, {key_columns}, TotalAmount, Quantity, Discount, Transactions, MinTotalAmount, MaxTotalAmount)
+        SELECT s.Date, {source_columns}, SUM(s.TotalAmount), SUM(s.Quantity), SUM(s.Discount), COUNT(*),
+               MIN(s.TotalAmount), MAX(s.TotalAmount)
+        FROM salesdetails s NOT INDEXED {join}
+        WHERE s.rowid > ? AND s.rowid <= ?
+        GROUP BY s.Date, {source_columns}
+        ON CONFLICT (Date, {key_columns}) DO UPDATE SET
+            TotalAmount = TotalAmount + excluded.TotalAmount,
+            Quantity = Quantity + excluded.Quantity,
+            Discount = Discount + excluded.Discount,
+            Transactions = Transactions + excluded.Transactions,
+            -- The scalar min() and max() return NULL if either side is NULL
+            MinTotalAmount = COALESCE(min(MinTotalAmount, excluded.MinTotalAmount), MinTotalAmount, excluded.MinTotalAmount),
+            MaxTotalAmount = COALESCE(max(MaxTotalAmount, excluded.MaxTotalAmount), MaxTotalAmount, excluded.MaxTotalAmount)
+    '''
+
+
+def update_rollups(db, after_rowid=None):
+    """
+    Add the salesdetails rows with a rowid above after_rowid to every rollup table.
+
+    By default those are the rows the last update did not reach, as recorded in
+    etl_progress together with the rollups. A database without that record (built
+    before it was kept) has its rollups rebuilt instead.
+    """
+    create_rollup_tables(db)
+    if after_rowid is None:
+        after_rowid = get_progress(db, 'rollups')
+        if after_rowid is None:
+            rebuild_rollups(db)
+            return
+    through_rowid = _max_sales_rowid(db)
+    for table in ROLLUPS:
+        db.execute(rollup_upsert_sql(table), (after_rowid, through_rowid))
+    save_progress(db, 'rollups', through_rowid)
+
+
+def rebuild_rollups(db):
+    """Recreate every rollup table from the whole of salesdetails."""
+    for table in ROLLUPS:
+        db.execute(f'DROP TABLE IF EXISTS "{table}"')
+    update_rollups(db, 0)
+
+
+# Step 2c: Columnar snapshot
+# After a refresh the ETL writes both tables as uncompressed Arrow IPC (Feather)
+# files next to the database, already in the TABLE_DTYPES schema, plus a manifest
+# naming the database state they were taken from. get_data() memory-maps the
+# files instead of reading and parsing the tables through SQL while that state holds.
+
+# The in-memory schema of the tables, applied by get_data() and the snapshot alike:
+# categoricals for low-cardinality text and the narrowest integer types that fit.
+# Money columns stay float64: float32 keeps about 7 significant digits, so sums
+# over many rows would drift from the database by dollars.
+# Columns not listed keep the type pandas gives them.
+TABLE_DTYPES = {
+    'salesdetails': {
+        'TransactionID': 'int32', 'Date': 'datetime64', 'ProductID': 'int32', 'Quantity': 'int16',
+        'Price': 'float64', 'Discount': 'float64', 'TotalAmount': 'float64', 'StoreID': 'int16',
+        'Region': 'category', 'SalespersonID': 'int32', 'CustomerID': 'int32',
+    },
+    'customerdetails': {'CustomerID': 'int32', 'City': 'category', 'State': 'category'},
+}
+
+
+def snapshot_path(table_name, db_name=None):
+    """data/sales_transactions.db -> data/sales_transactions.<table_name>.arrow"""
+    db_name = db_name or db_pool.get_pool().db_path
+    return f'{os.path.splitext(db_name)[0]}.{table_name}.arrow'
+
+
+def _snapshot_manifest_path(db_name):
+    return f'{os.path.splitext(db_name)[0]}.snapshot.json'
+
+
+def _fits(values, dtype):
+    limits = np.iinfo(dtype)
+    return len(values) == 0 or (values.min() >= limits.min and values.max() <= limits.max)
+
+
+def apply_dtypes(df, dtypes):
+    """
+    Cast the listed columns of df. Integer columns holding NULLs, or values too
+    large for the declared type, are left as they are rather than corrupted.
+    """
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+        if dtype == 'datetime64':
+            df[column] = pd.to_datetime(df[column])
+        elif dtype.startswith('int') and (df[column].isna().any() or not _fits(df[column], dtype)):
+            continue
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def _atomic_write(path, write):
+    # Workers may have the old file mapped, so write aside and swap it in. The
+    # temporary name is per process, as several workers may write at once.
+    tmp = f'{path}.{os.getpid()}.tmp'
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def write_snapshot(db, db_name=None):
+    """
+    Write the snapshot files for every table in TABLE_DTYPES. Returns their paths.
+
+    Run it after the refresh has been committed. The WAL is checkpointed first, so
+    the manifest records the database file as it stands with every change in it.
+    Each call bumps the manifest's version counter, which tells every worker
+    process to re-map the files.
+    """
+    if feather is None:
+        return {}
+    db_name = db_name or db_pool.get_pool().db_path
+    db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    written = {}
+    for table_name in TABLE_DTYPES:
+        df = read_table(db, table_name)
+        path = snapshot_path(table_name, db_name)
+        # One record batch per file, so readers can map every column without copying it
+        _atomic_write(path, lambda tmp: feather.write_feather(df, tmp, compression='uncompressed',
+                                                              chunksize=max(len(df), 1)))
+        written[table_name] = path
+
+    # Written last, so a manifest only ever describes complete files
+    previous = _read_snapshot_manifest(db_name) or {}
+    stat = os.stat(db_name)
+    manifest = {
+        'version': previous.get('version', 0) + 1,
+        'database_mtime_ns': stat.st_mtime_ns,
+        'database_size': stat.st_size,
+        'tables': sorted(written),
+        'dtypes': TABLE_DTYPES,
+    }
+    def write_manifest(tmp):
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+    _atomic_write(_snapshot_manifest_path(db_name), write_manifest)
+    return written
+
+
+def _read_snapshot_manifest(db_name):
+    try:
+        with open(_snapshot_manifest_path(db_name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _snapshot_matches_database(manifest, db_name):
+    # Files written with another schema are not used, the next refresh rewrites them
+    if manifest.get('dtypes') != TABLE_DTYPES:
+        return False
+    try:
+        stat = os.stat(db_name)
+    except OSError:
+        return False
+    if (stat.st_mtime_ns, stat.st_size) != (manifest.get('database_mtime_ns'), manifest.get('database_size')):
+        return False
+    try:
+        if os.stat(db_name + '-wal').st_size > 0:
+            return False
+    except FileNotFoundError:
+        pass
+    return all(os.path.exists(snapshot_path(table_name, db_name)) for table_name in TABLE_DTYPES)
+
+
+def snapshot_is_fresh(db_name=None):
+    """
+    True when the snapshot still matches the database: the database file is
+    unchanged since the snapshot was written and the WAL holds no newer commits.
+    """
+    db_name = db_name or db_pool.get_pool().db_path
+    manifest = _read_snapshot_manifest(db_name)
+    return manifest is not None and _snapshot_matches_database(manifest, db_name)
+
+
+def read_snapshot(table_name, db_name=None):
+    """
+    Load one snapshot file through a memory map. The columns point straight into
+    the mapped file, so every worker process shares the same pages of the OS page
+    cache instead of holding its own copy. The frames are read-only.
+    """
+    table = feather.read_table(snapshot_path(table_name, db_name), memory_map=True)
+    return table.to_pandas(split_blocks=True)
+
+
+# Step 3: Data Loading
+def connect_to_database(db_name):
+    return sqlite3.connect(db_name)
+
+@metrics.timed_stage('data')
+def query_database(query, params=None, explain=False, output='frame'):
+    """
+    Run a query on this thread's pooled connection, with params bound to its ? placeholders.
+
+    Keep values out of the SQL text: the connection then reuses the statement it
+    compiled on the first call (see db_pool.STATEMENT_CACHE_SIZE).
+    output='frame' returns a DataFrame, output='arrays' a {column: NumPy array}
+    dict without going through pandas.
+    """
+    conn = db_pool.get_pool().reader()
+    if explain:
+        query = f"EXPLAIN QUERY PLAN {query}"
+    if output == 'arrays':
+        cursor = conn.execute(query, params or ())
+        columns = [description[0] for description in cursor.description]
+        rows = cursor.fetchall()
+        values = zip(*rows) if rows else ([] for _ in columns)
+        return {column: np.array(column_values) for column, column_values in zip(columns, values)}
+    return pd.read_sql(query, conn, params=params)
+
+
+# Step 3b: Combining the queries
+
+# Process-wide dataset cache shared by every page callback. The frames are
+# loaded once and only reloaded when data_version() changes.
+_data_cache = {'version': None, 'sales': None, 'customers': None}
+_data_cache_lock = threading.Lock()
+
+# How long a worker keeps serving the last snapshot after the database has been
+# written to, while the refresh that wrote it publishes the new snapshot.
+SNAPSHOT_GRACE_SECONDS = 300
+
+
+def database_version(db_name=None):
+    """Return a token that changes whenever the database (or its WAL) is written."""
+    db_name = db_name or db_pool.get_pool().db_path
+    version = []
+    for path in (db_name, db_name + '-wal'):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            version.append(None)
+        else:
+            version.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+
+def data_version(db_name=None):
+    """
+    Return a token for the data get_data() serves.
+
+    While the snapshot is fresh this is ('snapshot', its version counter), so
+    worker processes re-map the files only when a refresh publishes a new one.
+    A worker already serving a snapshot keeps it while a refresh is in flight,
+    rather than every worker reading the whole database through SQL meanwhile.
+    Without a usable snapshot it is ('database', database_version()).
+    """
+    db_name = db_name or db_pool.get_pool().db_path
+    manifest = _read_snapshot_manifest(db_name) if feather is not None else None
+    if manifest is not None:
+        version = ('snapshot', manifest.get('version'))
+        if _snapshot_matches_database(manifest, db_name):
+            return version
+        written = [stamp[0] for stamp in database_version(db_name) if stamp is not None]
+        if _data_cache['version'] == version and written and time.time_ns() - max(written) < SNAPSHOT_GRACE_SECONDS * 1e9:
+            return version
+    return ('database', database_version(db_name))
+
+
+def invalidate_data_cache():
+    """Drop the cached frames so the next get_data() call reloads them."""
+    with _data_cache_lock:
+        _data_cache['version'] = None
+        _data_cache['sales'] = None
+        _data_cache['customers'] = None
+
+
+def read_table(db, table_name, chunksize=INGEST_BATCH_SIZE * 10):
+    """
+    Read a whole table into the TABLE_DTYPES schema. Chunks are cast as they
+    arrive, so peak memory stays close to the size of the compact frame.
+    """
+    dtypes = TABLE_DTYPES.get(table_name, {})
+    query = f'SELECT * FROM "{table_name}"'
+    chunks = [apply_dtypes(chunk, dtypes) for chunk in pd.read_sql_query(query, db, chunksize=chunksize)]
+    if not chunks:
+        return apply_dtypes(pd.read_sql_query(query, db), dtypes)
+    # Chunks can disagree on categories or integer widths, cast the result once more
+    return apply_dtypes(pd.concat(chunks, ignore_index=True), dtypes)
+
+
+def _load_data(version):
+    if version[0] == 'snapshot':
+        return read_snapshot('salesdetails'), read_snapshot('customerdetails')
+
+    conn = db_pool.get_pool().reader()
+    return read_table(conn, 'salesdetails'), read_table(conn, 'customerdetails')
+
+
+@metrics.timed_stage('data')
+def get_data():
+    """
+    Return (sales_df, customers_df) from the process-wide cache.
+
+    The tables are read once and reused until data_version() changes. Callers get
+    shallow copies that share the cached data, so they must treat them as
+    read-only (with pandas copy-on-write any write is applied to a private copy).
+    """
+    version = data_version()
+    with _data_cache_lock:
+        if _data_cache['version'] != version or _data_cache['sales'] is None:
+            sales_df, customers_df = _load_data(version)
+            _data_cache['sales'] = sales_df
+            _data_cache['customers'] = customers_df
+            _data_cache['version'] = version
+        sales_df = _data_cache['sales']
+        customers_df = _data_cache['customers']
+    return sales_df.copy(deep=False), customers_df.copy(deep=False)
+
+
+def data_memory_report():
+    """
+    Memory held by the cached frames, one row per column (bytes include string
+    contents), with a 'TOTAL' row per table. Loads the data if it is not cached yet.
+    """
+    sales_df, customers_df = get_data()
+    rows = []
+    for table_name, df in (('salesdetails', sales_df), ('customerdetails', customers_df)):
+        usage = df.memory_usage(deep=True, index=True)
+        for column, size in usage.items():
+            dtype = df[column].dtype if column in df.columns else df.index.dtype
+            rows.append({'Table': table_name, 'Column': column, 'Dtype': str(dtype), 'Bytes': int(size)})
+        rows.append({'Table': table_name, 'Column': 'TOTAL', 'Dtype': '', 'Bytes': int(usage.sum())})
+    report = pd.DataFrame(rows)
+    report['MB'] = (report['Bytes'] / 2**20).round(2)
+    return report
+
+
+def cached_per_data_version(func):
+    """
+    Decorator for argument-free functions deriving results from get_data().
+    The result is computed once and reused until data_version() changes.
+    """
+    cache = {'version': None, 'value': None}
+    lock = threading.Lock()
+
+    @functools.wraps(func)
+    def wrapper():
+        version = data_version()
+        with lock:
+            if cache['version'] != version:
+                cache['value'] = func()
+                cache['version'] = version
+            return cache['value']
+
+    def cache_clear():
+        with lock:
+            cache['version'] = None
+            cache['value'] = None
+
+    wrapper.cache_clear = cache_clear
+    return wrapper
+
+
+def sales_ranking(sales_df, key, value='TotalAmount'):
+    """
+    Totals of `value` per `key`, sorted largest first with a running total in
+    CumulativeTotal. Built once per data version, it answers top N for any N.
+    Summed in float64 whatever the column's type, so the totals match the database.
+    """
+    ranking = sales_df[value].astype('float64').groupby(sales_df[key]).sum().reset_index()
+    # Stable, so ties keep the same order as nlargest would give them
+    ranking = ranking.sort_values(value, ascending=False, kind='stable', ignore_index=True)
+    ranking['CumulativeTotal'] = ranking[value].cumsum()
+    return ranking
+
+
+def top_of_ranking(ranking, n):
+    """The first n rows of a sales_ranking() and their combined total, without re-aggregating."""
+    top = ranking.iloc[:max(int(n), 0)]
+    top_total = top['CumulativeTotal'].iloc[-1] if len(top) else 0.0
+    return top, top_total
+
+
+###############################################################################
+
+#################### Dashboard queries, aggregated in SQL ####################
+
+###############################################################################
+
+def _sales_filter(start_date, end_date, regions=None):
+    """Build the WHERE clause and bound parameters for a date range and optional regions."""
+    clauses = ["Date BETWEEN ? AND ?"]
+    params = [pd.to_datetime(start_date).strftime('%Y-%m-%d'), pd.to_datetime(end_date).strftime('%Y-%m-%d')]
+    if regions:
+        clauses.append(f"Region IN ({', '.join('?' for _ in regions)})")
+        params.extend(regions)
+    return ' AND '.join(clauses), params
+
+
+@metrics.timed_stage('data')
+def sales_filter_options():
+    """(first date, last date, regions) for the page filters, answered from the indexes."""
+    conn = db_pool.get_pool().reader()
+    # Separate subqueries: SQLite only answers a lone MIN() or MAX() from the index
+    # without scanning it
+    min_date, max_date = conn.execute(
+        'SELECT (SELECT MIN(Date) FROM salesdetails), (SELECT MAX(Date) FROM salesdetails)'
+    ).fetchone()
+    regions = [row[0] for row in conn.execute('SELECT DISTINCT Region FROM salesdetails ORDER BY Region')]
+    return min_date, max_date, regions
+
+
+@metrics.timed_stage('data')
+def sales_summary(start_date, end_date, regions=None):
+    """KPI card values for the date range (inclusive) and regions, from the daily customer rollup."""
+    where, params = _sales_filter(start_date, end_date, regions)
+    query = f"""
+    SELECT COALESCE(SUM(Transactions), 0) as transactions,
+           COALESCE(SUM(TotalAmount), 0) as total_sales,
+           COUNT(DISTINCT CustomerID) as total_customers,
+           COALESCE(SUM(Quantity), 0) as total_products_sold
+    FROM rollup_daily_customer
+    WHERE {where}
+    """
+    row = db_pool.get_pool().reader().execute(query, params).fetchone()
+    summary = dict(zip(['transactions', 'total_sales', 'total_customers', 'total_products_sold'], row))
+    # Every transaction is one order (TransactionID is unique in salesdetails)
+    summary['total_orders'] = summary['transactions']
+    summary['average_order_value'] = summary['total_sales'] / summary['total_orders'] if summary['total_orders'] else 0
+    return summary
+
+
+@metrics.timed_stage('data')
+def daily_sales(start_date, end_date, regions=None):
+    """Total sales per day for the date range (inclusive) and regions, as a Date/TotalAmount frame."""
+    where, params = _sales_filter(start_date, end_date, regions)
+    query = f"""
+    SELECT Date, SUM(TotalAmount) as TotalAmount
+    FROM rollup_daily_region
+    WHERE {where}
+    GROUP BY 1
+    ORDER BY 1
+    """
+    df = query_database(query, params)
+    df['Date'] = pd.to_datetime(df['Date'])
+    return df
+
+
+@metrics.timed_stage('data')
+def region_daily_sales(start_date, end_date, regions=None):
+    """Sales and transaction counts per day and region, from the daily region rollup."""
+    where, params = _sales_filter(start_date, end_date, regions)
+    query = f"""
+    SELECT Date, Region, TotalAmount, Transactions
+    FROM rollup_daily_region
+    WHERE {where}
+    ORDER BY Date
+    """
+    df = query_database(query, params)
+    df['Date'] = pd.to_datetime(df['Date'])
+    return df
+
+
+@metrics.timed_stage('data')
+def state_sales(start_date, end_date):
+    """Total sales per customer state for the date range, from the daily state rollup."""
+    where, params = _sales_filter(start_date, end_date)
+    query = f"""
+    SELECT State, SUM(TotalAmount) as TotalAmount
+    FROM rollup_daily_state
+    WHERE {where}
+    GROUP BY State
+    ORDER BY State
+    """
+    return query_database(query, params)
+
+
+@metrics.timed_stage('data')
+def filtered_sales(columns, start_date, end_date, regions=None):
+    """Only the requested columns of the transactions in the date range and regions."""
+    where, params = _sales_filter(start_date, end_date, regions)
+    query = f"""
+    SELECT {', '.join(f'"{col}"' for col in columns)}
+    FROM salesdetails
+    WHERE {where}
+    """
+    return query_database(query, params)
+
+
+@metrics.timed_stage('data')
+def sales_histogram(category, start_date, end_date, regions=None, value='TotalAmount', bins=30, top_n=10):
+    """
+    Histogram of `value` per `category` for the date range and regions, binned and counted in SQL.
+
+    Returns (edges, counts): the bin edges np.histogram_bin_edges gives for the values,
+    and {category: counts per bin}, most frequent category first. Only the top_n most
+    frequent categories are kept, the rest are added up as 'Other' (None keeps them all).
+
+    The TotalAmount bounds come from the daily region rollup. Only the counts read
+    the matching transactions, so they still take time in proportion to them.
+    """
+    where, params = _sales_filter(start_date, end_date, regions)
+    conn = db_pool.get_pool().reader()
+    if value == 'TotalAmount':
+        bounds = f'SELECT MIN(MinTotalAmount), MAX(MaxTotalAmount) FROM rollup_daily_region WHERE {where}'
+    else:
+        bounds = f'SELECT MIN("{value}"), MAX("{value}") FROM salesdetails WHERE {where}'
+    low, high = conn.execute(bounds, params).fetchone()
+    if low is None:
+        return np.histogram_bin_edges([], bins=bins), {}
+    edges = np.histogram_bin_edges([low, high], bins=bins)
+
+    # Equal-width bins, so the bin follows from the value as in np.histogram.
+    # The last bin is closed on the right. Clamped at both ends in case the rollup
+    # bounds lag behind the transactions (a refresh that failed part way).
+    query = f"""
+    SELECT CAST("{category}" AS TEXT) as category,
+           MAX(MIN(CAST(("{value}" - ?) / ? * ? AS INTEGER), ?), 0) as bin,
+           COUNT(*) as count
+    FROM salesdetails
+    WHERE {where} AND "{value}" IS NOT NULL
+    GROUP BY 1, 2
+    """
+    rows = query_database(query, [edges[0], edges[-1] - edges[0], bins, bins - 1] + params, output='arrays')
+
+    names, codes = np.unique(rows['category'].astype(str), return_inverse=True)
+    table = np.zeros((len(names), bins), dtype=np.int64)
+    np.add.at(table, (codes, rows['bin'].astype(int)), rows['count'])
+    # Most frequent first, ties by name
+    order = np.lexsort((names, -table.sum(axis=1)))
+    counts = {names[i]: table[i] for i in order[:top_n]}
+    if top_n is not None and len(order) > top_n:
+        counts['Other'] = table[order[top_n:]].sum(axis=0)
+    return edges, counts
+
+###############################################################################
+
+#################### Update the database using the below f ####################
+
+###############################################################################
+
+def update_database_from_csv(db, customer_csv, sales_csv, max_retries=5, stats=None):
+    """
+    Update the database with new rows from the CSV files.
+
+    Returns the highest salesdetails rowid from before the update, every new sale
+    has a larger one. transform_data() and update_rollups() keep their own record of
+    the rows they have processed, so they need no rowid passed.
+    Rows read, inserted and skipped per table are recorded in stats when a dict is given.
+
+    When a CSV has changed other than by appending rows, both tables are reloaded
+    in full instead (reload_from_csv), and the rowid returned is the highest after
+    the reload, as those rows are already transformed and rolled up.
+    """
+    # Taken once: batches committed by an attempt that then fails belong to this update too
+    last_rowid = _max_sales_rowid(db)
+    for attempt in range(max_retries):
+        try:
+            # Update customer details from the watermark onwards, streamed in batches.
+            # The primary key makes INSERT OR IGNORE skip customers that already exist.
+            with open_csv_increment(db, customer_csv) as (reader, _):
+                reader = _RowCounter(reader)
+                insert_sql = '''
+                    INSERT OR IGNORE INTO customerdetails
+                    ("CustomerID", "CustomerName", "City", "State", "Postcode")
+                    VALUES (?, ?, ?, ?, ?)
+                '''
+                customers = ((int(row['CustomerID']), row.get('CustomerName'), row.get('City'), row.get('State'), row.get('Postcode'))
+                             for row in reader if row['CustomerID'].isdigit())
+                new_customers = insert_batches(db, insert_sql, customers)
+            _record_ingest(stats, 'customerdetails', reader.count, new_customers)
+
+            if new_customers:
+                print(f"Inserted {new_customers} new customers into customerdetails table.")
+            else:
+                print("No new customers to insert.")
+
+            # Update sales details from the watermark onwards, streamed in batches. Existing
+            # transactions (e.g. after a rescan) are skipped with an indexed lookup.
+            with open_csv_increment(db, sales_csv) as (reader, _):
+                sales_fieldnames = reader.fieldnames
+                id_index = sales_fieldnames.index('TransactionID')
+                columns = ', '.join(sales_fieldnames)
+                placeholders = ', '.join('?' for _ in sales_fieldnames)
+                reader = _RowCounter(reader)
+                insert_sql = f'''
+                    INSERT INTO salesdetails ({columns})
+                    SELECT {placeholders}
+                    WHERE NOT EXISTS (SELECT 1 FROM salesdetails WHERE TransactionID = ?)
+                '''
+                sales = (values + (values[id_index],)
+                         for values in (tuple(to_iso_date(row[col]) if col == 'Date' else row[col] for col in sales_fieldnames) for row in reader))
+                new_sales = insert_batches(db, insert_sql, sales)
+            _record_ingest(stats, 'salesdetails', reader.count, new_sales)
+
+            if new_sales:
+                print(f"Inserted {new_sales} new transactions into salesdetails table.")
+            else:
+                print("No new sales transactions to insert.")
+
+            break  # If successful, exit the retry loop
+        except SourceChanged as e:
+            print(f"{e} has changed since the last refresh, reloading both tables in full.")
+            reload_from_csv(db, customer_csv, sales_csv, stats)
+            last_rowid = _max_sales_rowid(db)
+            break
+        except sqlite3.OperationalError as e:
+            if 'database is locked' in str(e):
+                print(f"Attempt {attempt + 1} of {max_retries} failed: database is locked. Retrying in 1 second...")
+                time.sleep(1)  # Wait before retrying
+            else:
+                raise
+    else:
+        print("Failed to update the database after multiple attempts due to database being locked.")
+    return last_rowid
+
+
+def print_table_contents(db, table_name):
+    """Print the contents of a table."""
+    print(f"Contents of {table_name} table:")
+    cursor = db.execute(f'SELECT * FROM "{table_name}"')
+    rows = cursor.fetchall()
+    for row in rows:
+        print(row)
+    if not rows:
+        print("No data found.")
+    print()
+
+###############################################################################
+
+#################### Illustrate the required queries below ####################
+
+###############################################################################
+
+
+# Relative date windows, in calendar months up to and including the month of the
+# latest sale. The data ends in December 2023, where these give the periods the
+# assessment asks for.
+RELATIVE_WINDOWS = {'last_month': 1, 'last_quarter': 3, 'last_six_months': 6}
+
+
+@cached_per_data_version
+def latest_sale_date():
+    """The last Date in salesdetails, as YYYY-MM-DD."""
+    latest = db_pool.get_pool().reader().execute('SELECT MAX(Date) FROM salesdetails').fetchone()[0]
+    if latest is None:
+        raise ValueError('salesdetails is empty, relative date windows need at least one sale')
+    return latest
+
+
+def date_window(window):
+    """
+    (start, end) as inclusive YYYY-MM-DD bounds for a window, which is either a
+    (start, end) pair of dates or relative to the latest sale: a key of
+    RELATIVE_WINDOWS or a number of calendar months. 'last_quarter' is the
+    calendar quarter of the latest sale.
+    """
+    if isinstance(window, (tuple, list)):
+        start, end = window
+        return pd.to_datetime(start).strftime('%Y-%m-%d'), pd.to_datetime(end).strftime('%Y-%m-%d')
+
+    latest = latest_sale_date()
+    if window == 'last_quarter':
+        start = pd.Period(latest, 'Q').start_time
+    else:
+        months = RELATIVE_WINDOWS.get(window, window)
+        if not isinstance(months, int) or months < 1:
+            raise ValueError(f'Unknown date window {window!r}')
+        start = (pd.Period(latest, 'M') - (months - 1)).start_time
+    return start.strftime('%Y-%m-%d'), latest
+
+
+def extract_sales_last_quarter(window='last_quarter', explain=False, output='frame'):
+    """Every transaction in the window, by default the calendar quarter of the latest sale."""
+    query = """
+    SELECT * FROM salesdetails
+    WHERE Date >= ? AND Date <= ?
+    """
+    return query_database(query, date_window(window), explain=explain, output=output)
+
+
+
+def calculate_total_sales_per_region(explain=False, output='frame'):
+    query = """
+    SELECT Region, SUM(TotalAmount) as total_sales
+    FROM salesdetails
+    GROUP BY Region
+    """
+    return query_database(query, explain=explain, output=output)
+
+
+# Join the sales data with a customer details table to find the total sales amount per customer
+def total_sales_per_customer(explain=False, output='frame'):
+    query = """
+    SELECT c.CustomerID, SUM(s.TotalAmount) as total_sales
+    FROM salesdetails s
+    JOIN customerdetails c ON s.CustomerID = c.CustomerID
+    GROUP BY c.CustomerID
+    """
+    return query_database(query, explain=explain, output=output)
+
+
+def top_products(window='last_month', n=10, explain=False, output='frame'):
+    """The n products with the highest sales in the window, from the daily product rollup."""
+    query = """
+    SELECT ProductID, SUM(TotalAmount) as total_sales
+    FROM rollup_daily_product
+    WHERE Date >= ? AND Date <= ?
+    GROUP BY ProductID
+    ORDER BY total_sales DESC
+    LIMIT ?
+    """
+    return query_database(query, (*date_window(window), int(n)), explain=explain, output=output)
+
+
+# Retrieve the top 10 products by sales amount in the last month (December 2023)
+def top_10_products_last_month(explain=False, output='frame'):
+    return top_products('last_month', 10, explain=explain, output=output)
+
+
+# Identify customers who have not made a purchase in the last six months (from 01/07/2023 to 31/12/2023)
+def customers_no_purchase_last_six_months(window='last_six_months', explain=False, output='frame'):
+    query = """
+    SELECT * FROM customerdetails
+    WHERE CustomerID NOT IN (
+        SELECT DISTINCT CustomerID
+        FROM salesdetails
+        WHERE Date >= ? AND Date <= ?
+    )
+    """
+    return query_database(query, date_window(window), explain=explain, output=output)
+
+
+# Every library query should be answered from an index rather than a full scan of salesdetails
+LIBRARY_QUERIES = [
+    extract_sales_last_quarter,
+    calculate_total_sales_per_region,
+    total_sales_per_customer,
+    top_10_products_last_month,
+    customers_no_purchase_last_six_months,
+]
+
+
+def check_query_plans():
+    """Return {query name: plan} for every library query that scans salesdetails without an index."""
+    unindexed = {}
+    for query in LIBRARY_QUERIES:
+        plan = query(explain=True)['detail'].tolist()
+        # customerdetails is the small dimension table, scanning it is expected
+        if any(step.startswith('SCAN') and 'INDEX' not in step and not step.startswith('SCAN customerdetails') for step in plan):
+            unindexed[query.__name__] = plan
+    return unindexed
\ No newline at end of file
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the data refresh (database.refresh_database) as a background job. The
+Refresh Data button only submits the job and polls its status, so the web worker
+returns at once and the dashboards keep serving during the refresh.
+
+Only one refresh runs at a time across every worker process: the job holds an
+exclusive lock on a file next to the database (<db>.refresh.lock) until it ends,
+and clicking while it is held returns the job in progress instead of starting
+another. Job state is kept in <db>.refresh-jobs.json, so any worker can answer
+the status polls. The lock is released by the OS if a worker dies mid-refresh,
+and its job is then reported as interrupted.
+
+The locks use fcntl.flock, or msvcrt.locking on Windows.
+
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from flask import jsonify
+
+import db_pool
+import pySQL_library as hrdb
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# Finished jobs kept around for status lookups
+MAX_FINISHED_JOBS = 20
+
+INTERRUPTED = 'The refresh was interrupted before it finished (its worker stopped).'
+
+# How long start_refresh() waits for a job that has just finished to release the
+# refresh lock, before answering with a 'busy' job instead
+BUSY_RETRIES = 20
+BUSY_RETRY_SECONDS = 0.05
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='data-refresh')
+        return _executor
+
+
+def _path(suffix):
+    # Kept next to the database, so every worker serving it shares them
+    return f'{os.path.splitext(db_pool.get_pool().db_path)[0]}.{suffix}'
+
+
+def _open_locked(path, blocking):
+    """
+    Open path and lock it exclusively. Returns the open file, or None when another
+    holder has the lock and blocking is off. Release it with _close_locked().
+    """
+    f = open(path, 'a+')
+    while True:
+        try:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            return f
+        except OSError:
+            # LK_LOCK gives up after about 10 seconds, flock blocks until it succeeds
+            if blocking and fcntl is None:
+                continue
+            f.close()
+            if blocking:
+                raise
+            return None
+
+
+def _close_locked(f):
+    if fcntl is None:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    f.close()
+
+
+def _try_lock_refresh():
+    """The refresh lock as an open file, or None when another job holds it."""
+    return _open_locked(_path('refresh.lock'), blocking=False)
+
+
+@contextmanager
+def _state_lock():
+    lock = _open_locked(_path('refresh-jobs.lock'), blocking=True)
+    try:
+        yield
+    finally:
+        _close_locked(lock)
+
+
+@contextmanager
+def _jobs_state():
+    """
+    Hold the job state lock and yield the {job id: job} dict. Changes made to it
+    are written back when the block exits.
+    """
+    with _state_lock():
+        jobs = _read_jobs()
+        yield jobs
+        path = _path('refresh-jobs.json')
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(jobs, f)
+        os.replace(tmp, path)
+
+
+def _read_jobs():
+    try:
+        with open(_path('refresh-jobs.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _mark_interrupted(jobs):
+    # Only called with the refresh lock held, so no job can still be in progress
+    for job in jobs.values():
+        if job['status'] in ('queued', 'running'):
+            job.update(status='failed', error=INTERRUPTED, finished=time.time())
+
+
+def _update_job(job_id, **changes):
+    with _jobs_state() as jobs:
+        jobs[job_id].update(changes)
+
+
+def _run_refresh(job_id, refresh_lock):
+    try:
+        _update_job(job_id, status='running', started=time.time())
+        try:
+            # Imported here so the ETL (and requests) only load when a refresh is asked for
+            import database
+            result = database.refresh_database()
+        except Exception as e:
+            _update_job(job_id, status='failed', error=str(e), finished=time.time())
+        else:
+            _update_job(job_id, status='succeeded', result=result, finished=time.time())
+        finally:
+            # The dashboards reload the data on their next callback
+            hrdb.invalidate_data_cache()
+    finally:
+        # Released after the final status is written, see get_job()
+        _close_locked(refresh_lock)
+
+
+def start_refresh():
+    """
+    Submit a refresh job, or return the one already in progress. Returns a copy of the job.
+
+    When the refresh lock stays held but no job in progress is recorded (the state
+    file was lost or unreadable), the result is a job with status 'busy' and no id.
+    """
+    for _ in range(BUSY_RETRIES):
+        with _jobs_state() as jobs:
+            refresh_lock = _try_lock_refresh()
+            if refresh_lock is not None:
+                _mark_interrupted(jobs)
+                job = _add_job(jobs)
+                break
+            running = [j for j in jobs.values() if j['status'] in ('queued', 'running')]
+            if running:
+                return dict(max(running, key=lambda j: j['submitted']))
+        # Usually the job holding the lock has just finished and is releasing it
+        time.sleep(BUSY_RETRY_SECONDS)
+    else:
+        return {
+            'id': None,
+            'status': 'busy',
+            'submitted': time.time(),
+            'started': None,
+            'finished': None,
+            'error': 'Another refresh is holding the lock.',
+            'result': None,
+        }
+
+    try:
+        _get_executor().submit(_run_refresh, job['id'], refresh_lock)
+    except Exception:
+        _close_locked(refresh_lock)
+        raise
+    return job
+
+
+def _add_job(jobs):
+    job_id = uuid.uuid4().hex
+    jobs[job_id] = {
+        'id': job_id,
+        'status': 'queued',
+        'submitted': time.time(),
+        'started': None,
+        'finished': None,
+        'error': None,
+        'result': None,
+    }
+
+    finished = [j for j in jobs.values() if j['finished'] is not None]
+    for job in sorted(finished, key=lambda j: j['finished'])[:-MAX_FINISHED_JOBS]:
+        del jobs[job['id']]
+
+    return dict(jobs[job_id])
+
+
+def get_job(job_id):
+    """Return a copy of the job, or None if it is unknown."""
+    # Read under the lock, Windows cannot replace the file while it is open
+    with _state_lock():
+        job = _read_jobs().get(job_id)
+    if job is None or job['status'] not in ('queued', 'running'):
+        return job
+
+    # A job in progress holds the refresh lock. If it is free, the job has either
+    # just finished (the state read above is stale) or its worker died.
+    refresh_lock = _try_lock_refresh()
+    if refresh_lock is None:
+        return job
+    try:
+        with _jobs_state() as jobs:
+            _mark_interrupted(jobs)
+            job = jobs.get(job_id)
+            return dict(job) if job is not None else None
+    finally:
+        _close_locked(refresh_lock)
+
+
+def register_status_route(app):
+    """Expose job status as JSON at /refresh-status/<job_id> on the Flask server."""
+    def refresh_status(job_id):
+        job = get_job(job_id)
+        if job is None:
+            return jsonify({'id': job_id, 'status': 'unknown'}), 404
+        return jsonify(job)
+
+    app.server.add_url_rule('/refresh-status/<job_id>', 'refresh_status', refresh_status)
@@ -0,0 +1,35 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+import db_pool  # noqa: E402
+import pySQL_library as hrdb  # noqa: E402
+from benchmarks.generate import write_dataset  # noqa: E402
+
+
+ROWS = 2000
+
+
+def _reset_caches():
+    hrdb.invalidate_data_cache()
+    hrdb.latest_sale_date.cache_clear()
+
+
+@pytest.fixture
+def sales_db(tmp_path):
+    """A database built by the ETL from a small synthetic dataset, used by the shared pool."""
+    customer_csv, sales_csv = write_dataset(str(tmp_path / 'csv'), ROWS)
+    db = str(tmp_path / 'sales_transactions.db')
+    pool = db_pool.configure(db)
+    _reset_caches()
+    sources = {'customers': customer_csv, 'sales': sales_csv}
+    database.refresh(sources, db, download=False)
+    yield SimpleNamespace(db=db, pool=pool, sources=sources, customers=customer_csv, sales=sales_csv)
+    pool.close()
+    db_pool.configure()
+    _reset_caches()
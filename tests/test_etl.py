@@ -0,0 +1,122 @@
+import itertools
+import sqlite3
+
+import pytest
+
+import database
+import pySQL_library as hrdb
+from benchmarks.generate import append_sales
+from conftest import ROWS
+
+
+def _sales_totals(conn):
+    return conn.execute('SELECT COUNT(*), SUM(TotalAmount) FROM salesdetails').fetchone()
+
+
+def _assert_rollups_match(conn):
+    count, total = _sales_totals(conn)
+    for table in ('rollup_daily_region', 'rollup_daily_customer', 'rollup_daily_product', 'rollup_daily_state'):
+        transactions, amount = conn.execute(f'SELECT SUM(Transactions), SUM(TotalAmount) FROM {table}').fetchone()
+        assert transactions == count, table
+        assert amount == pytest.approx(total), table
+    bounds = conn.execute('''
+        SELECT COUNT(*) FROM rollup_daily_region r
+        JOIN (SELECT Date, Region, MIN(TotalAmount) as low, MAX(TotalAmount) as high
+              FROM salesdetails GROUP BY Date, Region) s ON s.Date = r.Date AND s.Region = r.Region
+        WHERE r.MinTotalAmount = s.low AND r.MaxTotalAmount = s.high
+    ''').fetchone()[0]
+    assert bounds == conn.execute('SELECT COUNT(*) FROM rollup_daily_region').fetchone()[0]
+
+
+# Rows transform_data() would still change
+_UNTRANSFORMED = '''
+    SELECT COUNT(*) FROM salesdetails
+    WHERE (TotalAmount IS NULL OR TotalAmount = 0 OR TotalAmount = (Quantity * Price))
+    AND TotalAmount IS NOT (Quantity * Price) - Discount
+'''
+
+
+def _edit_total_amount(path, line_number, value):
+    with open(path) as f:
+        lines = f.readlines()
+    fields = lines[line_number].split(',')
+    fields[7] = value  # TotalAmount
+    lines[line_number] = ','.join(fields)
+    with open(path, 'w') as f:
+        f.writelines(lines)
+    return int(fields[0])
+
+
+def test_appended_rows_are_ingested_incrementally(sales_db):
+    append_sales(sales_db.sales, 300, ROWS)
+    stats = database.refresh(sales_db.sources, sales_db.db, download=False)
+
+    assert stats['tables']['salesdetails'] == {'read': 300, 'inserted': 300, 'skipped': 0}
+    conn = sales_db.pool.reader()
+    assert _sales_totals(conn)[0] == ROWS + 300
+    _assert_rollups_match(conn)
+
+
+def test_edited_rows_reload_the_tables(sales_db):
+    transaction_id = _edit_total_amount(sales_db.sales, 10, '12345.67')
+    append_sales(sales_db.sales, 300, ROWS)
+    stats = database.refresh(sales_db.sources, sales_db.db, download=False)
+
+    assert stats['tables']['salesdetails'] == {'read': ROWS + 300, 'inserted': ROWS + 300, 'skipped': 0}
+    conn = sales_db.pool.reader()
+    amount = conn.execute('SELECT TotalAmount FROM salesdetails WHERE TransactionID = ?', (transaction_id,)).fetchone()[0]
+    assert amount == 12345.67
+    assert _sales_totals(conn)[0] == ROWS + 300
+    _assert_rollups_match(conn)
+
+
+def test_unchanged_sources_write_nothing(sales_db):
+    stats = database.refresh(sales_db.sources, sales_db.db, download=False)
+    assert stats['updated'] is False
+
+
+def test_retried_update_returns_the_rowid_from_before_every_attempt(sales_db, monkeypatch):
+    insert_batches = hrdb.insert_batches
+    calls = []
+
+    def locked_after_first_batch(db, insert_sql, rows, batch_size=hrdb.INGEST_BATCH_SIZE):
+        calls.append(insert_sql)
+        if len(calls) == 2:  # the first sales attempt commits 100 rows, then fails
+            insert_batches(db, insert_sql, itertools.islice(rows, 100), batch_size)
+            raise sqlite3.OperationalError('database is locked')
+        return insert_batches(db, insert_sql, rows, batch_size)
+
+    monkeypatch.setattr(hrdb, 'insert_batches', locked_after_first_batch)
+    monkeypatch.setattr(hrdb.time, 'sleep', lambda seconds: None)
+    append_sales(sales_db.sales, 300, ROWS)
+    with sales_db.pool.writer() as conn:
+        before = conn.execute('SELECT MAX(rowid) FROM salesdetails').fetchone()[0]
+        assert hrdb.update_database_from_csv(conn, sales_db.customers, sales_db.sales) == before
+        assert conn.execute('SELECT COUNT(*) FROM salesdetails WHERE rowid > ?', (before,)).fetchone()[0] == 300
+
+
+@pytest.mark.parametrize('stage', ['transform_data', 'update_rollups'])
+def test_refresh_after_a_failed_refresh_catches_up(sales_db, monkeypatch, stage):
+    def fail(db, after_rowid=None):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    append_sales(sales_db.sales, 300, ROWS)
+    with monkeypatch.context() as patch:
+        patch.setattr(hrdb, stage, fail)
+        with pytest.raises(sqlite3.OperationalError):
+            database.refresh(sales_db.sources, sales_db.db, download=False)
+    append_sales(sales_db.sales, 200, ROWS + 300)
+    database.refresh(sales_db.sources, sales_db.db, download=False)
+
+    conn = sales_db.pool.reader()
+    assert _sales_totals(conn)[0] == ROWS + 500
+    assert conn.execute(_UNTRANSFORMED).fetchone()[0] == 0
+    _assert_rollups_match(conn)
+
+
+def test_rollup_updates_search_the_rowid_range(sales_db):
+    conn = sales_db.pool.reader()
+    for table in hrdb.ROLLUPS:
+        plan = ' | '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + hrdb.rollup_upsert_sql(table), (0, 0)))
+        assert 'SEARCH s USING INTEGER PRIMARY KEY (rowid>? AND rowid<?)' in plan, plan
+        assert 'SCAN s' not in plan, plan
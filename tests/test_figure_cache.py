@@ -0,0 +1,101 @@
+import os
+
+import pytest
+from dash import no_update
+
+import figure_cache
+from figure_cache import FigureCache, normalize_input
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """A fresh in-memory process cache for cached_callback."""
+    cache = FigureCache(max_bytes=1024 * 1024, directory=None)
+    monkeypatch.setattr(figure_cache, '_cache', cache)
+    return cache
+
+
+def test_normalize_input():
+    assert normalize_input('2023-01-01T00:00:00') == '2023-01-01'
+    assert normalize_input('2023-01-01 00:00:00.000') == '2023-01-01'
+    assert normalize_input('2023-01-01T12:30:00') == '2023-01-01T12:30:00'
+    assert normalize_input(['West', 'East', 'West']) == ['East', 'West']
+    assert normalize_input(('b', 'a')) == ['a', 'b']
+    assert normalize_input({'start': '2023-01-01T00:00:00', 'regions': ['b', 'a']}) == {'start': '2023-01-01', 'regions': ['a', 'b']}
+    assert normalize_input(10) == 10
+    assert normalize_input(None) is None
+
+
+def test_memory_is_bounded_by_bytes():
+    cache = FigureCache(max_bytes=100, directory=None)
+    cache.put('a', b'x' * 40)
+    cache.put('b', b'x' * 40)
+    assert cache.get('a') is not None  # now the most recently used
+    cache.put('c', b'x' * 40)
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    stats = cache.stats()
+    assert stats['bytes'] == 80
+    assert stats['evictions'] == 1
+
+    # Larger than the whole cache: not kept at all
+    cache.put('d', b'x' * 101)
+    assert cache.get('d') is None
+    assert cache.stats()['bytes'] == 80
+
+
+def test_disk_is_bounded_by_bytes(tmp_path):
+    cache = FigureCache(max_bytes=1024, directory=str(tmp_path), max_disk_bytes=100)
+    for i, key in enumerate('abc'):
+        cache.put(key, b'x' * 40)
+        os.utime(tmp_path / f'{key}.json', (i, i))  # Oldest first, whatever the clock resolution
+    cache.put('d', b'x' * 40)
+    assert sorted(os.listdir(tmp_path)) == ['c.json', 'd.json']
+
+
+def test_clear_ignores_files_removed_meanwhile(tmp_path, monkeypatch):
+    cache = FigureCache(directory=str(tmp_path))
+    cache.put('a', b'{}')
+
+    def removed_by_another_worker(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(figure_cache.os, 'remove', removed_by_another_worker)
+    cache.clear()
+    assert cache.stats()['entries'] == 0
+
+
+def test_results_are_keyed_on_the_data_version(cache):
+    version = {'value': 1}
+    calls = []
+
+    @figure_cache.cached_callback(version=lambda: version['value'])
+    def callback(start_date, regions):
+        calls.append((start_date, regions))
+        return {'total': len(calls)}
+
+    assert callback('2023-01-01', ['West', 'East']) == {'total': 1}
+    # The same inputs in another form are a hit
+    assert callback('2023-01-01T00:00:00', ['East', 'West']) == {'total': 1}
+    assert len(calls) == 1
+
+    version['value'] = 2
+    assert callback('2023-01-01', ['East', 'West']) == {'total': 2}
+    assert len(calls) == 2
+
+
+def test_no_update_results_are_not_cached(cache):
+    calls = []
+
+    @figure_cache.cached_callback(version=lambda: 1)
+    def callback(n):
+        calls.append(n)
+        return {'n': n}, no_update
+
+    for _ in range(2):
+        figure, unchanged = callback(1)
+        assert unchanged is no_update
+    assert len(calls) == 2
+    assert cache.stats()['uncacheable'] == 2
+    assert cache.stats()['stores'] == 0
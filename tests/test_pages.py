@@ -0,0 +1,21 @@
+import pySQL_library as hrdb
+
+
+def test_region_page_for_a_single_day(sales_db):
+    from pages import sales_by_region
+
+    day, _, _ = hrdb.sales_filter_options()
+    diamond, choropleth = sales_by_region.update_graphs.__wrapped__(day, day)
+    history = diamond.data[-1]
+    assert len(history.x) == 0
+
+
+def test_region_page_history_has_a_point_per_earlier_day(sales_db):
+    from pages import sales_by_region
+
+    start, end, _ = hrdb.sales_filter_options()
+    diamond, _ = sales_by_region.update_graphs.__wrapped__(start, end)
+    days = hrdb.region_daily_sales(start, end)['Date'].nunique()
+    history = diamond.data[-1]
+    assert len(history.x) == len(history.text) == days - 1
+    assert history.text[0].startswith(f'Date: {start}')
@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import db_pool
+import pySQL_library as hrdb
+
+
+def test_library_queries_use_indexes(sales_db):
+    assert hrdb.check_query_plans() == {}
+
+
+def test_schema_version_recorded_after_full_load(sales_db):
+    version = sales_db.pool.reader().execute('PRAGMA user_version').fetchone()[0]
+    assert version == hrdb.SCHEMA_VERSION
+
+
+def test_migration_skipped_once_recorded(sales_db):
+    statements = []
+    with sales_db.pool.writer() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            hrdb.migrate_salesdetails(conn)
+        finally:
+            conn.set_trace_callback(None)
+    assert not [s for s in statements if s.lstrip().upper().startswith(('UPDATE', 'ANALYZE', 'CREATE INDEX'))]
+
+
+def test_migration_converts_old_databases(sales_db):
+    with sales_db.pool.writer() as conn:
+        conn.execute("UPDATE salesdetails SET Date = '5/03/2023' WHERE rowid = 1")
+        conn.execute('PRAGMA user_version = 0')
+    with sales_db.pool.writer() as conn:
+        hrdb.migrate_salesdetails(conn)
+        assert conn.execute('SELECT Date FROM salesdetails WHERE rowid = 1').fetchone()[0] == '2023-03-05'
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == hrdb.SCHEMA_VERSION
+
+
+@pytest.mark.parametrize('category', ['CustomerID', 'ProductID'])
+def test_sales_histogram_matches_numpy(sales_db, category):
+    start, end, regions = hrdb.sales_filter_options()
+    edges, counts = hrdb.sales_histogram(category, start, end, regions[:2], bins=30, top_n=5)
+
+    sales = hrdb.filtered_sales(['TotalAmount', category], start, end, regions[:2])
+    values = sales['TotalAmount'].to_numpy(dtype=float)
+    categories = sales[category].astype(str).to_numpy()
+    np.testing.assert_array_equal(edges, np.histogram_bin_edges(values, bins=30))
+
+    top = [name for name in counts if name != 'Other']
+    assert len(top) == 5
+    frequencies = pd.Series(categories).value_counts()
+    assert frequencies[top].min() >= frequencies.drop(top).max()
+    for name in top:
+        np.testing.assert_array_equal(counts[name], np.histogram(values[categories == name], edges)[0])
+    np.testing.assert_array_equal(counts['Other'], np.histogram(values[~np.isin(categories, top)], edges)[0])
+
+
+def test_sales_histogram_reads_the_transactions_once(sales_db):
+    start, end, regions = hrdb.sales_filter_options()
+    conn = sales_db.pool.reader()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        hrdb.sales_histogram('CustomerID', start, end, regions)
+    finally:
+        conn.set_trace_callback(None)
+    assert len([s for s in statements if 'FROM salesdetails' in s]) == 1
+
+
+def test_migration_adds_the_rollup_bounds(sales_db):
+    with sales_db.pool.writer() as conn:
+        conn.execute('UPDATE rollup_daily_region SET MinTotalAmount = NULL, MaxTotalAmount = NULL')
+        conn.execute('PRAGMA user_version = 1')
+    with sales_db.pool.writer() as conn:
+        hrdb.migrate_salesdetails(conn)
+        missing = conn.execute('SELECT COUNT(*) FROM rollup_daily_region WHERE MinTotalAmount IS NULL').fetchone()[0]
+    assert missing == 0
+
+
+def test_sales_histogram_of_an_empty_range(sales_db):
+    edges, counts = hrdb.sales_histogram('ProductID', '1990-01-01', '1990-01-31')
+    assert counts == {}
+
+
+def test_money_columns_match_the_database(sales_db):
+    sales, _ = hrdb.get_data()
+    for column in ('Price', 'Discount', 'TotalAmount'):
+        assert sales[column].dtype == 'float64', column
+
+    expected = hrdb.query_database('SELECT CustomerID, SUM(TotalAmount) as TotalAmount FROM salesdetails GROUP BY CustomerID')
+    totals = sales.groupby('CustomerID')['TotalAmount'].sum()
+    np.testing.assert_allclose(totals[expected['CustomerID']].to_numpy(), expected['TotalAmount'].to_numpy(), rtol=1e-12)
+
+
+def test_snapshot_of_another_schema_is_not_used(sales_db, monkeypatch):
+    assert hrdb.snapshot_is_fresh()
+    monkeypatch.setitem(hrdb.TABLE_DTYPES['salesdetails'], 'TotalAmount', 'float32')
+    assert not hrdb.snapshot_is_fresh()
+
+
+@pytest.mark.parametrize('key', ['CustomerID', 'ProductID'])
+def test_sales_ranking_matches_sql_sums(sales_db, key):
+    sales, _ = hrdb.get_data()
+    # Summed in float64 even when the frame holds float32
+    narrow = sales.assign(TotalAmount=sales['TotalAmount'].astype('float32'))
+    ranking = hrdb.sales_ranking(narrow, key).set_index(key)
+
+    expected = hrdb.query_database(f'SELECT {key}, SUM(TotalAmount) as TotalAmount FROM salesdetails GROUP BY {key}').set_index(key)
+    total = hrdb.query_database('SELECT SUM(TotalAmount) as total FROM salesdetails')['total'][0]
+    np.testing.assert_allclose(ranking.loc[expected.index, 'TotalAmount'], expected['TotalAmount'], rtol=1e-7)
+    assert ranking['CumulativeTotal'].iloc[-1] == pytest.approx(total, rel=1e-7)
+
+
+def test_page_totals_match_sql_sums(sales_db):
+    from pages import best_selling_products, top_customers
+
+    # Their cache is keyed on the data version, which every test database starts at
+    top_customers.customer_summaries.cache_clear()
+    best_selling_products.product_summaries.cache_clear()
+    total = hrdb.query_database('SELECT SUM(TotalAmount) as total FROM salesdetails')['total'][0]
+    assert top_customers.customer_summaries()[2] == pytest.approx(total, rel=1e-12)
+    assert best_selling_products.product_summaries()[1] == pytest.approx(total, rel=1e-12)
+
+
+def test_database_from_an_older_etl_is_upgraded_on_first_read(sales_db):
+    start, end, _ = hrdb.sales_filter_options()
+    expected = hrdb.sales_summary(start, end)
+    # As the ETL before the rollups left it: d/mm/yyyy dates, no indexes, rollups or progress
+    with sales_db.pool.writer() as conn:
+        day, month, year = conn.execute('SELECT Date FROM salesdetails WHERE rowid = 1').fetchone()[0][:10].split('-')[::-1]
+        conn.execute('UPDATE salesdetails SET Date = ? WHERE rowid = 1', (f'{int(day)}/{month}/{year}',))
+        for table in list(hrdb.ROLLUPS) + ['etl_progress']:
+            conn.execute(f'DROP TABLE "{table}"')
+        for name in hrdb.SALESDETAILS_INDEXES:
+            conn.execute(f'DROP INDEX "{name}"')
+        conn.execute('PRAGMA user_version = 0')
+
+    db_pool.configure(sales_db.db)
+    assert hrdb.sales_summary(start, end) == expected
+    assert hrdb.check_query_plans() == {}
+
+
+def test_filter_options_search_the_date_index(sales_db):
+    conn = sales_db.pool.reader()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        hrdb.sales_filter_options()
+    finally:
+        conn.set_trace_callback(None)
+    date_range = next(s for s in statements if 'MIN(Date)' in s)
+    plan = [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + date_range)]
+    assert not [step for step in plan if step.startswith('SCAN salesdetails')], plan
@@ -0,0 +1,126 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+import database
+import refresh_jobs
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _in_other_process(db, code):
+    """Run code with refresh_jobs imported in a new process serving db, returning what it prints as JSON."""
+    env = dict(os.environ, SALES_DB_PATH=db)
+    out = subprocess.run([sys.executable, '-c', f'import json, refresh_jobs; print(json.dumps({code}))'],
+                         cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out)
+
+
+def _wait_until_finished(job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = refresh_jobs.get_job(job_id)
+        if job['status'] not in ('queued', 'running'):
+            return job
+        time.sleep(0.02)
+    pytest.fail(f'refresh job {job_id} did not finish')
+
+
+@pytest.fixture
+def blocked_refresh(sales_db, monkeypatch):
+    """Refreshes wait for release.set() and then return {'ok': True}."""
+    release = threading.Event()
+
+    def refresh_database():
+        release.wait(10)
+        return {'ok': True}
+
+    monkeypatch.setattr(database, 'refresh_database', refresh_database)
+    yield release
+    release.set()
+
+
+def test_one_refresh_across_processes(sales_db, blocked_refresh):
+    job = refresh_jobs.start_refresh()
+    assert refresh_jobs.start_refresh()['id'] == job['id']
+
+    # Another worker sees the job and does not start a second one
+    assert _in_other_process(sales_db.db, "refresh_jobs.start_refresh()['id']") == job['id']
+    assert _in_other_process(sales_db.db, f"refresh_jobs.get_job({job['id']!r})['status']") in ('queued', 'running')
+
+    blocked_refresh.set()
+    finished = _wait_until_finished(job['id'])
+    assert finished['status'] == 'succeeded'
+    assert finished['result'] == {'ok': True}
+    assert _in_other_process(sales_db.db, f"refresh_jobs.get_job({job['id']!r})['status']") == 'succeeded'
+
+
+def test_job_of_a_stopped_worker_is_interrupted(sales_db, blocked_refresh):
+    # Recorded as running, but nothing holds the refresh lock
+    with refresh_jobs._jobs_state() as jobs:
+        jobs['stale'] = {'id': 'stale', 'status': 'running', 'submitted': time.time(), 'started': time.time(),
+                         'finished': None, 'error': None, 'result': None}
+
+    stale = refresh_jobs.get_job('stale')
+    assert stale['status'] == 'failed'
+    assert stale['error'] == refresh_jobs.INTERRUPTED
+
+    job = refresh_jobs.start_refresh()
+    assert job['id'] != 'stale'
+    blocked_refresh.set()
+    assert _wait_until_finished(job['id'])['status'] == 'succeeded'
+
+
+def test_unknown_job(sales_db):
+    assert refresh_jobs.get_job('missing') is None
+
+
+def test_busy_when_the_lock_is_held_without_a_job(sales_db, monkeypatch):
+    monkeypatch.setattr(refresh_jobs, 'BUSY_RETRIES', 2)
+    monkeypatch.setattr(refresh_jobs, 'BUSY_RETRY_SECONDS', 0)
+    # Held as by a job in another worker, whose state entry has been lost
+    held = refresh_jobs._try_lock_refresh()
+    try:
+        job = refresh_jobs.start_refresh()
+    finally:
+        refresh_jobs._close_locked(held)
+    assert job['status'] == 'busy'
+    assert job['id'] is None
+
+
+def _fake_msvcrt(fcntl):
+    """msvcrt.locking on top of flock, enough to run the Windows code path here."""
+    def locking(fd, mode, nbytes):
+        operation = {msvcrt.LK_LOCK: fcntl.LOCK_EX, msvcrt.LK_NBLCK: fcntl.LOCK_EX | fcntl.LOCK_NB,
+                     msvcrt.LK_UNLCK: fcntl.LOCK_UN}[mode]
+        fcntl.flock(fd, operation)
+
+    msvcrt = types.SimpleNamespace(LK_UNLCK=0, LK_LOCK=1, LK_NBLCK=2, locking=locking)
+    return msvcrt
+
+
+def test_windows_locks(sales_db, blocked_refresh, monkeypatch):
+    fcntl = pytest.importorskip('fcntl')
+    monkeypatch.setitem(sys.modules, 'fcntl', None)
+    monkeypatch.setitem(sys.modules, 'msvcrt', _fake_msvcrt(fcntl))
+    spec = importlib.util.spec_from_file_location('refresh_jobs_windows', os.path.join(ROOT, 'refresh_jobs.py'))
+    windows = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(windows)
+    assert windows.fcntl is None
+
+    job = windows.start_refresh()
+    assert windows.start_refresh()['id'] == job['id']
+    assert refresh_jobs.start_refresh()['id'] == job['id']
+    blocked_refresh.set()
+    deadline = time.time() + 10
+    while windows.get_job(job['id'])['status'] in ('queued', 'running') and time.time() < deadline:
+        time.sleep(0.02)
+    assert windows.get_job(job['id'])['status'] == 'succeeded'